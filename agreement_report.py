@@ -0,0 +1,225 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from jaal.jaal.agreement_matrix import AgreementMatrix
+from jaal.jaal.annotator_agreement import AGREEMENT_GRANULARITIES, AnnotatorAgreement
+from jaal.rs3_cache import RS3Cache
+from jaal.rs3_parser_ import DEFAULT_VIEW, VIEW_BUILDERS, RS3Parser
+
+# write the checkpoint after this many documents by default
+DEFAULT_CHECKPOINT_EVERY = 100
+OUTPUT_FORMATS = ['csv', 'parquet']
+
+
+class AgreementReport():
+    """Corpus wide agreement aggregates, accumulated one document at a time.
+
+    Only the running totals are kept: per relation, per annotator pair and one row per document, each with the
+    number of nodes and of agreed nodes at every granularity of `AGREEMENT_GRANULARITIES`. The totals are plain
+    counts, so the report can be saved to a checkpoint and resumed from it.
+    """
+    def __init__(self):
+        self.relations: dict[str, list[int]] = {}
+        self.pairs: dict[tuple[str, str], list[int]] = {}
+        self.documents: list[dict] = []
+        self.done: set[str] = set()
+
+    def add(self, document_aggregates: dict) -> None:
+        """Adds the aggregates of one document, as returned by `document_aggregates`."""
+        for relation, counts in document_aggregates['relations'].items():
+            totals = self.relations.setdefault(relation, [0] * len(counts))
+            self.relations[relation] = [total + count for total, count in zip(totals, counts)]
+        for annotator_a, annotator_b, *counts in document_aggregates['pairs']:
+            totals = self.pairs.setdefault((annotator_a, annotator_b), [0] * (len(counts) + 1))
+            self.pairs[(annotator_a, annotator_b)] = [total + count for total, count in zip(totals, [1, *counts])]
+        self.documents.append(document_aggregates['document'])
+        self.done.add(document_aggregates['document']['document'])
+
+    def to_frames(self) -> dict[str, pd.DataFrame]:
+        """The 'relations', 'annotator_pairs' and 'documents' tables, with agreement ratios per granularity."""
+        granularities = list(AGREEMENT_GRANULARITIES)
+
+        relations = pd.DataFrame(
+            [[relation, *counts] for relation, counts in sorted(self.relations.items())],
+            columns=['relation', 'nodes', *[f'agreed_{granularity}' for granularity in granularities]],
+        )
+        for granularity in granularities:
+            relations[f'ratio_{granularity}'] = relations[f'agreed_{granularity}'] / relations['nodes']
+
+        pairs = pd.DataFrame(
+            [[*pair, *counts] for pair, counts in sorted(self.pairs.items())],
+            columns=['annotator_a', 'annotator_b', 'documents', 'size_a', 'size_b', *[f'matches_{granularity}' for granularity in granularities]],
+        )
+        for granularity in granularities:
+            matches = pairs[f'matches_{granularity}']
+            pairs[f'precision_{granularity}'] = matches / pairs['size_b']
+            pairs[f'recall_{granularity}'] = matches / pairs['size_a']
+            pairs[f'f1_{granularity}'] = 2 * matches / (pairs['size_a'] + pairs['size_b'])
+
+        documents = pd.DataFrame(
+            self.documents, columns=['document', 'annotators', 'nodes', *[f'agreed_{granularity}' for granularity in granularities]]
+        )
+        for granularity in granularities:
+            documents[f'ratio_{granularity}'] = documents[f'agreed_{granularity}'] / documents['nodes']
+        return {'relations': relations, 'annotator_pairs': pairs, 'documents': documents.sort_values('document', ignore_index=True)}
+
+    def write(self, directory, output_format: str ='csv') -> list[Path]:
+        """Writes every table of `to_frames` to `<directory>/<table>.<format>` and returns the written paths."""
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        paths = []
+        for name, frame in self.to_frames().items():
+            path = directory / f'{name}.{output_format}'
+            if output_format == 'csv':
+                frame.to_csv(path, index=False)
+            else:
+                frame.to_parquet(path, index=False)
+            paths.append(path)
+        return paths
+
+    def save_checkpoint(self, path) -> None:
+        """Stores the running totals, written next to the target and renamed so a crash never leaves half a file."""
+        path = Path(path)
+        state = {
+            'relations': self.relations,
+            'pairs': [[*pair, *counts] for pair, counts in self.pairs.items()],
+            'documents': self.documents,
+        }
+        partial_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        partial_path.write_text(json.dumps(state))
+        os.replace(partial_path, path)
+
+    @classmethod
+    def load_checkpoint(cls, path) -> 'AgreementReport':
+        """Restores the totals of `save_checkpoint`, an empty report if there is no checkpoint yet."""
+        report = cls()
+        path = Path(path)
+        if not path.exists():
+            return report
+
+        state = json.loads(path.read_text())
+        report.relations = state['relations']
+        report.pairs = {(annotator_a, annotator_b): counts for annotator_a, annotator_b, *counts in state['pairs']}
+        report.documents = state['documents']
+        report.done = {document['document'] for document in report.documents}
+        return report
+
+
+def document_aggregates(parser: RS3Parser, document: str, files: dict[str, Path]) -> dict:
+    """Parses the annotations of one document and counts its nodes and agreed nodes.
+
+    Only the internal nodes of the annotators' trees are counted, the EDU leaves agree by construction. The
+    result holds plain Python values only, so it is cheap to send back from a worker process.
+    """
+    nodes, _ = parser.parse_files(files)
+    annotator_agreement = AnnotatorAgreement()
+    nodes = annotator_agreement.find_agreements(nodes)
+    nodes = nodes[~nodes['is_leaf'] & nodes['annotator'].notna()]
+    annotators = nodes.attrs['annotators']
+    agreement_columns = list(AGREEMENT_GRANULARITIES.values())
+    agreed = nodes[agreement_columns].to_numpy(dtype=np.uint64) != 0
+
+    has_relation = nodes['relation'].notna().to_numpy()
+    relation_counts = pd.DataFrame(agreed[has_relation], columns=agreement_columns).assign(nodes=1).groupby(
+        nodes['relation'].astype(object).to_numpy()[has_relation]
+    )[['nodes', *agreement_columns]].sum()
+
+    # pairs count distinct spans, a span annotated twice by the same annotator (unary chains, duplicates) once, so
+    # they are taken from `AgreementMatrix` and match it on the same corpus
+    pair_agreement = AgreementMatrix().compute(nodes)
+    pair_counts = {
+        (annotator_a, annotator_b, level): (int(size_a), int(size_b), int(matches))
+        for annotator_a, annotator_b, level, size_a, size_b, matches in pair_agreement[['annotator_a', 'annotator_b', 'level', 'size_a', 'size_b', 'matches']].itertuples(index=False)
+    }
+    pairs = []
+    for annotator_a, annotator_b in combinations(annotators, 2):
+        counts = [pair_counts.get((annotator_a, annotator_b, granularity), (0, 0, 0)) for granularity in AGREEMENT_GRANULARITIES]
+        pairs.append([annotator_a, annotator_b, counts[0][0], counts[0][1], *(matches for _, _, matches in counts)])
+
+    return {
+        'relations': {relation: list(map(int, counts)) for relation, counts in zip(relation_counts.index, relation_counts.to_numpy())},
+        'pairs': pairs,
+        'document': {
+            'document': document,
+            'annotators': len(files),
+            'nodes': len(nodes),
+            **{f'agreed_{granularity}': int(count) for granularity, count in zip(AGREEMENT_GRANULARITIES, agreed.sum(axis=0))},
+        },
+    }
+
+
+def run_report(parser: RS3Parser, directory, report: AgreementReport, max_workers: int | None =1, checkpoint=None, checkpoint_every: int =DEFAULT_CHECKPOINT_EVERY) -> AgreementReport:
+    """Adds every document of a `<directory>/<annotator>/<document>.rs3` corpus not yet in `report`.
+
+    Documents are parsed in `max_workers` processes (`None` for every core), at most twice as many documents as
+    workers are in flight, so memory stays bounded whatever the corpus size. The report is saved to `checkpoint`
+    every `checkpoint_every` documents and at the end, running again with the same checkpoint resumes the corpus.
+    """
+    documents = [(document, files) for document, files in parser.scan_corpus(directory).items() if document not in report.done]
+
+    def added(document_result: dict, count: int) -> None:
+        report.add(document_result)
+        if checkpoint is not None and count % checkpoint_every == 0:
+            report.save_checkpoint(checkpoint)
+
+    if max_workers == 1:
+        for count, (document, files) in enumerate(documents, 1):
+            added(document_aggregates(parser, document, files), count)
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending: deque = deque()
+            count = 0
+            for document, files in documents:
+                pending.append(executor.submit(document_aggregates, parser, document, files))
+                if len(pending) >= 2 * workers:
+                    count += 1
+                    added(pending.popleft().result(), count)
+            while pending:
+                count += 1
+                added(pending.popleft().result(), count)
+
+    if checkpoint is not None:
+        report.save_checkpoint(checkpoint)
+    return report
+
+
+def main(argv: list[str] | None =None):
+    argument_parser = argparse.ArgumentParser(description="Corpus wide inter-annotator agreement report of a <corpus>/<annotator>/<document>.rs3 directory")
+    argument_parser.add_argument('corpus', type=Path, help="corpus directory")
+    argument_parser.add_argument('-o', '--output', type=Path, default=Path('agreement_report'), help="directory the tables are written to (default: ./agreement_report)")
+    argument_parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='csv', help="output format (default: csv)")
+    argument_parser.add_argument('-w', '--workers', type=int, default=1, help="number of worker processes, 0 for every core (default: 1)")
+    argument_parser.add_argument('--checkpoint', type=Path, help="checkpoint file to resume from and save to (default: <output>/checkpoint.json)")
+    argument_parser.add_argument('--checkpoint-every', type=int, default=DEFAULT_CHECKPOINT_EVERY, help=f"documents between checkpoints (default: {DEFAULT_CHECKPOINT_EVERY})")
+    argument_parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint")
+    argument_parser.add_argument('--view', choices=list(VIEW_BUILDERS), default=DEFAULT_VIEW, help=f"tree view the agreement is computed on (default: {DEFAULT_VIEW})")
+    argument_parser.add_argument('--align-segments', action='store_true', help="compare spans on shared token offsets, for annotators with differing segmentations")
+    argument_parser.add_argument('--cache', type=Path, help="directory of the parsed frame cache (default: no cache)")
+    arguments = argument_parser.parse_args(argv)
+
+    arguments.output.mkdir(parents=True, exist_ok=True)
+    checkpoint = arguments.checkpoint or arguments.output / 'checkpoint.json'
+    report = AgreementReport() if arguments.restart else AgreementReport.load_checkpoint(checkpoint)
+
+    parser = RS3Parser(
+        view=arguments.view,
+        align_segments=arguments.align_segments,
+        cache=RS3Cache(arguments.cache) if arguments.cache else None,
+    )
+    run_report(parser, arguments.corpus, report, max_workers=arguments.workers or None, checkpoint=checkpoint, checkpoint_every=arguments.checkpoint_every)
+    for path in report.write(arguments.output, arguments.format):
+        print(path)
+
+if __name__ == "__main__":
+    main()
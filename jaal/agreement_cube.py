@@ -0,0 +1,217 @@
+"""
+Pre-aggregated inter-annotator agreement counts of a corpus
+
+The agreement of every annotator pair is counted once per document and relation, and over all relations, at every
+granularity of `AGREEMENT_GRANULARITIES`. Slicing and pivoting the counts is then independent of the number of nodes, the
+dashboard's '/cube' page draws its heatmaps from them.
+"""
+
+from itertools import combinations
+import numpy as np
+import pandas as pd
+
+from jaal.jaal.agreement_matrix import AgreementMatrix
+from jaal.jaal.annotator_agreement import AGREEMENT_GRANULARITIES
+
+CUBE_DIMENSIONS = ['document', 'relation', 'annotator_pair', 'granularity']
+CUBE_METRICS = ['f1', 'precision', 'recall', 'matches', 'size_a', 'size_b']
+_COUNTS = ['size_a', 'size_b', 'matches']
+
+
+class AgreementCube:
+    """Pre-aggregated agreement counts over document x relation x annotator pair x granularity.
+
+    Every cell holds, for one annotator pair 'A / B' within one document, the number of distinct spans of A
+    ('size_a') and of B ('size_b') labelled with a relation, and the number of those spans both annotators
+    labelled with it that agree at the granularity ('matches'), so 'full' and 'nuclearity' agree within a relation.
+    The spans are matched by intersecting their span keys, as `AgreementMatrix` does. Cells without a relation hold
+    the counts over all spans of the pair whatever their labels, the ones of `AgreementMatrix`, they answer the
+    pivots that neither split nor filter by relation. Cells are built document by document and are small, so
+    slicing and pivoting never touch node level data. The dimensions are kept as integer codes and a pivot is a
+    single `np.bincount` per count, the totals over all documents are also rolled up in advance.
+    """
+    def __init__(self, cells: pd.DataFrame | None = None):
+        """
+        Parameters
+        -------------
+        cells: pandas dataframe (optional)
+            cells of a cube, as returned by `cells_from_nodes` or stored by `to_parquet`
+        """
+        self._pending: list[pd.DataFrame] = [] if cells is None else [cells]
+        self._cells: pd.DataFrame | None = None
+        self._rollup: pd.DataFrame | None = None
+        # dimension codes and counts of the cells and of the rollup, as plain arrays
+        self._arrays: dict[int, dict[str, np.ndarray]] = {}
+
+    @classmethod
+    def from_corpus(cls, parser, directory) -> 'AgreementCube':
+        """Builds the cube of a corpus document by document through `RS3Parser.parse_corpus`."""
+        cube = cls()
+        # one annotator index for the whole corpus, documents may lack some of the annotators
+        annotators = sorted({annotator for files in parser.scan_corpus(directory).values() for annotator in files})
+        for _, nodes, _ in parser.parse_corpus(directory):
+            nodes.attrs["annotators"] = annotators
+            cube.add(nodes)
+        return cube
+
+    @classmethod
+    def from_parquet(cls, path) -> 'AgreementCube':
+        return cls(pd.read_parquet(path))
+
+    def to_parquet(self, path) -> None:
+        self.cells.to_parquet(path, index=False)
+
+    def add(self, node_dataframe: pd.DataFrame) -> None:
+        """Adds the cells of the nodes of one or many documents, see `cells_from_nodes`."""
+        self._pending.append(self.cells_from_nodes(node_dataframe))
+        self._cells = self._rollup = None
+        self._arrays = {}
+
+    @staticmethod
+    def cells_from_nodes(node_dataframe: pd.DataFrame) -> pd.DataFrame:
+        """Counts the cells of the annotated internal nodes of a frame, one row per non-empty cell.
+
+        The annotators of `attrs["annotators"]` (the annotators of the frame by default) are paired in order, the
+        rows without relation hold the counts over all spans of a pair.
+        """
+        nodes = node_dataframe[~node_dataframe["is_leaf"] & (node_dataframe["first_edu"] >= 0) & node_dataframe["annotator"].notna()]
+        annotators = node_dataframe.attrs.get("annotators") or sorted(nodes["annotator"].unique().tolist())
+
+        documents = nodes["document"].astype(str) if "document" in nodes.columns else pd.Series("", index=nodes.index)
+        document_codes, document_names = pd.factorize(documents, sort=True)
+        annotator_codes = pd.Categorical(nodes["annotator"], categories=annotators).codes
+        spans = AgreementMatrix()._annotator_spans(nodes, annotator_codes, document_codes, len(annotators))
+        # the relations of the codes of `_annotator_spans`, slot 0 of every document holds the counts over all spans
+        relation_names = pd.factorize(nodes["relation"].astype(object))[1]
+        slots = len(relation_names) + 1
+        slot_relations = np.concatenate([[None], relation_names.to_numpy(dtype=object)])
+        cell_count = len(document_names) * slots
+        # documents of each annotator, a pair only has cells in the documents both annotated
+        annotated = np.zeros((len(annotators), len(document_names)), dtype=bool)
+        annotated[annotator_codes[annotator_codes >= 0], document_codes[annotator_codes >= 0]] = True
+
+        def count(documents_of_spans, relations_of_spans):
+            """Spans per cell, every span counts in the total of its document and in the cell of its relation."""
+            labelled = relations_of_spans >= 0
+            return (
+                np.bincount(documents_of_spans * slots, minlength=cell_count)
+                + np.bincount(documents_of_spans[labelled] * slots + relations_of_spans[labelled] + 1, minlength=cell_count)
+            )
+
+        frames = []
+        for a, b in combinations(range(len(annotators)), 2):
+            keys_a, nuclearity_a, relation_a, documents_a = spans[a]
+            keys_b, nuclearity_b, relation_b, documents_b = spans[b]
+            size_a, size_b = count(documents_a, relation_a), count(documents_b, relation_b)
+            cells = np.flatnonzero((size_a + size_b > 0) & np.repeat(annotated[a] & annotated[b], slots))
+
+            _, index_a, index_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+            same_nuclearity = nuclearity_a[index_a] == nuclearity_b[index_b]
+            same_relation = relation_a[index_a] == relation_b[index_b]
+            # a matched span counts in a relation only if both annotators labelled it with that relation
+            shared_relation = np.where(same_relation, relation_a[index_a], -1)
+            matched = {'span': np.ones(len(index_a), dtype=bool), 'nuclearity': same_nuclearity, 'full': same_nuclearity & same_relation}
+            for granularity in AGREEMENT_GRANULARITIES:
+                matches = count(documents_a[index_a][matched[granularity]], shared_relation[matched[granularity]])
+                frames.append(pd.DataFrame({
+                    "document": document_names[cells // slots],
+                    "relation": slot_relations[cells % slots],
+                    "annotator_pair": f"{annotators[a]} / {annotators[b]}",
+                    "granularity": granularity,
+                    "size_a": size_a[cells],
+                    "size_b": size_b[cells],
+                    "matches": matches[cells],
+                }))
+        if not frames:
+            return pd.DataFrame({column: pd.Series(dtype=object if column in CUBE_DIMENSIONS else np.int64) for column in CUBE_DIMENSIONS + _COUNTS})
+        return pd.concat(frames, ignore_index=True)
+
+    @property
+    def cells(self) -> pd.DataFrame:
+        """All cells, with categorical dimensions."""
+        if self._cells is None:
+            cells = pd.concat(self._pending, ignore_index=True) if self._pending else pd.DataFrame(columns=CUBE_DIMENSIONS + _COUNTS)
+            for dimension in CUBE_DIMENSIONS:
+                cells[dimension] = cells[dimension].astype("category")
+            self._cells = cells
+            self._pending = [cells]
+        return self._cells
+
+    def categories(self, dimension: str) -> list[str]:
+        return self.cells[dimension].cat.categories.tolist()
+
+    def pivot(self, index: str = 'relation', columns: str = 'annotator_pair', metric: str = 'f1', granularity: str = 'full', documents: list[str] | None = None, relations: list[str] | None = None, annotator_pairs: list[str] | None = None) -> pd.DataFrame:
+        """The `metric` of every `index` x `columns` combination at one granularity, summed over the other dimensions.
+
+        `granularity` is ignored if it is one of the axes. `documents`, `relations` and `annotator_pairs` restrict the
+        cells that are summed (all by default). Ratios are computed from the summed counts, so they weigh every node
+        equally. Queries over all documents that do not split by document are answered from the rollup, whose size
+        does not depend on the number of documents.
+        """
+        if index == columns or {index, columns} - set(CUBE_DIMENSIONS):
+            raise ValueError(f"Expected two different dimensions of {CUBE_DIMENSIONS}, got '{index}' and '{columns}'")
+        if metric not in CUBE_METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {CUBE_METRICS}")
+
+        cells = self.cells if documents is not None or "document" in (index, columns) else self.rollup
+        arrays = self._cell_arrays(cells)
+        selected = np.ones(len(cells), dtype=bool)
+        if "granularity" not in (index, columns):
+            selected &= arrays["granularity"] == cells["granularity"].cat.categories.get_indexer([granularity])[0]
+        # cells of a relation only count the spans labelled with it, the cells without relation count all spans
+        if "relation" in (index, columns) or relations is not None:
+            selected &= arrays["relation"] >= 0
+        else:
+            selected &= arrays["relation"] < 0
+        for dimension, values in [("document", documents), ("relation", relations), ("annotator_pair", annotator_pairs)]:
+            if values is not None:
+                codes = cells[dimension].cat.categories.get_indexer(values)
+                # a lookup table of the wanted codes is faster than `np.isin` over millions of cells
+                wanted = np.zeros(len(cells[dimension].cat.categories) + 1, dtype=bool)
+                wanted[codes[codes >= 0]] = True
+                selected &= wanted[arrays[dimension]]
+
+        index_names, column_names = cells[index].cat.categories, cells[columns].cat.categories
+        flat_codes = arrays[index][selected] * len(column_names) + arrays[columns][selected]
+        totals = {
+            count: np.bincount(flat_codes, weights=arrays[count][selected], minlength=len(index_names) * len(column_names))
+            for count in _COUNTS
+        }
+        values = self._metric(metric, **totals).reshape(len(index_names), len(column_names))
+
+        # only the rows and columns with any cells left
+        present = np.bincount(flat_codes, minlength=len(index_names) * len(column_names)).reshape(len(index_names), len(column_names)) > 0
+        rows, columns_present = present.any(axis=1), present.any(axis=0)
+        values = np.where(present, values, np.nan)[rows][:, columns_present]
+        return pd.DataFrame(values, index=pd.Index(index_names[rows], name=index), columns=pd.Index(column_names[columns_present], name=columns))
+
+    @property
+    def rollup(self) -> pd.DataFrame:
+        """The cells summed over all documents, with a single 'document' category."""
+        if self._rollup is None:
+            keys = ["relation", "annotator_pair", "granularity"]
+            rollup = self.cells.groupby(keys, observed=True, dropna=False)[_COUNTS].sum().reset_index()
+            rollup["document"] = pd.Categorical(["all"] * len(rollup))
+            for dimension in keys:
+                rollup[dimension] = rollup[dimension].astype("category")
+            self._rollup = rollup
+        return self._rollup
+
+    def _cell_arrays(self, cells: pd.DataFrame) -> dict[str, np.ndarray]:
+        arrays = self._arrays.get(id(cells))
+        if arrays is None:
+            arrays = {dimension: cells[dimension].cat.codes.to_numpy().astype(np.int64) for dimension in CUBE_DIMENSIONS}
+            arrays |= {count: cells[count].to_numpy(dtype=np.float64) for count in _COUNTS}
+            self._arrays[id(cells)] = arrays
+        return arrays
+
+    @staticmethod
+    def _metric(metric: str, size_a: np.ndarray, size_b: np.ndarray, matches: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if metric == "precision":
+                return matches / size_b
+            if metric == "recall":
+                return matches / size_a
+            if metric == "f1":
+                return 2 * matches / (size_a + size_b)
+        return {"matches": matches, "size_a": size_a, "size_b": size_b}[metric]
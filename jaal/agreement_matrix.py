@@ -0,0 +1,199 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import os
+import numpy as np
+import pandas as pd
+
+from jaal.jaal.annotator_agreement import _span_keys
+
+# levels of RST-Parseval style agreement: the bare span, then the span with its nuclearity, its relation or both
+AGREEMENT_LEVELS = ['span', 'nuclearity', 'relation', 'full']
+
+# spans of each annotator, set by `_init_worker` in the processes computing the pairs
+_annotator_spans: dict = {}
+
+
+class AgreementMatrix:
+    """Pairwise inter-annotator agreement of RST trees, RST-Parseval style.
+
+    The constituents of every annotator are the spans of its internal nodes, keyed by a single integer hash of
+    (document, first EDU, last EDU, explicit EDUs), or of their shared token offsets after `align_segments`. For every annotator pair the span keys are intersected with
+    NumPy set operations, over all documents both annotators annotated at once, and the matched spans are compared
+    by their nuclearity and relation codes. Precision, recall and F1 take the first annotator of a pair as the
+    reference. The span kappa counts every candidate span of a document (N(N+1)/2 for N EDUs) as a yes/no decision
+    of each annotator, the label kappas are Cohen's kappa of the labels on the matched spans. Spans in token offsets
+    may start at the EDU boundary of either annotator, so N is then the number of distinct EDU starts of the pair.
+    """
+    def __init__(self, max_workers: int | None =1):
+        """
+        Parameters
+        -------------
+        max_workers: int (optional)
+            number of processes the annotator pairs are spread over, `None` uses every available core
+            (default: 1, i.e. compute in the calling process)
+        """
+        self.max_workers = max_workers
+
+    def compute(self, node_dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Computes the agreement of every annotator pair at every level of `AGREEMENT_LEVELS`, from the nodes of one
+        or many documents (told apart by the 'document' column, if present).
+
+        Returns one row per (annotator_a, annotator_b, level) with the number of shared 'documents', the span
+        counts 'size_a' and 'size_b' on those documents, the 'matches' and 'precision', 'recall', 'f1' and 'kappa'.
+        """
+        nodes = node_dataframe[~node_dataframe["is_leaf"] & (node_dataframe["first_edu"] >= 0) & node_dataframe["annotator"].notna()]
+        annotators = sorted(nodes["annotator"].unique().tolist())
+
+        documents = nodes["document"].astype(str) if "document" in nodes.columns else pd.Series("", index=nodes.index)
+        document_codes, document_names = pd.factorize(documents, sort=True)
+        annotator_codes = pd.Categorical(nodes["annotator"], categories=annotators).codes
+
+        # number of EDUs of each document, and the spans of each annotator per document
+        edu_counts = pd.Series(nodes["last_edu"].to_numpy()).groupby(document_codes).max().reindex(range(len(document_names)), fill_value=-1).to_numpy() + 1
+        candidate_spans = edu_counts * (edu_counts + 1) // 2
+        # spans in token offsets are counted in token offsets too, see `_token_candidate_spans`
+        boundaries = self._token_boundaries(node_dataframe, document_names, annotators) if "first_token" in nodes.columns else None
+
+        spans = self._annotator_spans(nodes, annotator_codes, document_codes, len(annotators))
+        span_counts = np.zeros((len(annotators), len(document_names)), dtype=np.int64)
+        annotated = np.zeros((len(annotators), len(document_names)), dtype=bool)
+        for annotator, (keys, _, _, documents_of_keys) in spans.items():
+            span_counts[annotator] = np.bincount(documents_of_keys, minlength=len(document_names))
+        annotated[annotator_codes, document_codes] = True
+
+        pairs = list(combinations(range(len(annotators)), 2))
+        pair_matches = self._pair_matches(spans, pairs)
+
+        rows = []
+        for (a, b), matches in zip(pairs, pair_matches):
+            shared = annotated[a] & annotated[b]
+            size_a = int(span_counts[a, shared].sum())
+            size_b = int(span_counts[b, shared].sum())
+            if boundaries is not None:
+                candidate_spans = self._token_candidate_spans(boundaries, a, b, len(document_names))
+            candidates = int(candidate_spans[shared].sum())
+            for level in AGREEMENT_LEVELS:
+                matched, label_kappa = matches[level]
+                kappa = self._span_kappa(matched, size_a, size_b, candidates) if level == 'span' else label_kappa
+                rows.append({
+                    "annotator_a": annotators[a],
+                    "annotator_b": annotators[b],
+                    "level": level,
+                    "documents": int(shared.sum()),
+                    "size_a": size_a,
+                    "size_b": size_b,
+                    "matches": matched,
+                    "precision": matched / size_b if size_b else np.nan,
+                    "recall": matched / size_a if size_a else np.nan,
+                    "f1": 2 * matched / (size_a + size_b) if size_a + size_b else np.nan,
+                    "kappa": kappa,
+                })
+        return pd.DataFrame(rows, columns=[
+            "annotator_a", "annotator_b", "level", "documents", "size_a", "size_b", "matches", "precision", "recall", "f1", "kappa"
+        ])
+
+    @staticmethod
+    def to_matrix(agreement: pd.DataFrame, level: str ='span', metric: str ='f1') -> pd.DataFrame:
+        """Pivots the result of `compute` to a symmetric annotator x annotator matrix of one metric at one level."""
+        rows = agreement[agreement["level"] == level]
+        annotators = sorted(set(rows["annotator_a"]) | set(rows["annotator_b"]))
+        matrix = pd.DataFrame(np.nan, index=annotators, columns=annotators)
+        for a, b, value in zip(rows["annotator_a"], rows["annotator_b"], rows[metric]):
+            matrix.loc[a, b] = matrix.loc[b, a] = value
+        return matrix
+
+    @staticmethod
+    def _token_boundaries(node_dataframe: pd.DataFrame, document_names: pd.Index, annotators: list[str]) -> pd.DataFrame:
+        """The distinct EDU starts of every annotator and document, in the token offsets of `align_segments`.
+
+        Shared EDU leaves have no annotator, they get the annotator code -1 and belong to every annotator.
+        """
+        leaves = node_dataframe[node_dataframe["is_leaf"] & (node_dataframe["first_token"] >= 0)]
+        documents = leaves["document"].astype(str) if "document" in leaves.columns else pd.Series("", index=leaves.index)
+        boundaries = pd.DataFrame({
+            "document": document_names.get_indexer(documents),
+            "token": leaves["first_token"].to_numpy(),
+            "annotator": pd.Categorical(leaves["annotator"], categories=annotators).codes,
+        })
+        return boundaries[boundaries["document"] >= 0].drop_duplicates()
+
+    @staticmethod
+    def _token_candidate_spans(boundaries: pd.DataFrame, a: int, b: int, document_count: int) -> np.ndarray:
+        """Candidate spans of every document for a pair, N(N+1)/2 for the N distinct EDU starts of either annotator."""
+        pair_boundaries = boundaries[boundaries["annotator"].isin([-1, a, b])].drop_duplicates(["document", "token"])
+        edu_counts = np.bincount(pair_boundaries["document"].to_numpy(), minlength=document_count)
+        return edu_counts * (edu_counts + 1) // 2
+
+    def _annotator_spans(self, nodes: pd.DataFrame, annotator_codes: np.ndarray, document_codes: np.ndarray, annotator_count: int) -> dict:
+        """Sorted unique span keys of every annotator, with the nuclearity and relation code and document of each."""
+        span_keys = pd.util.hash_pandas_object(_span_keys(nodes), index=False).to_numpy()
+
+        nuclearity = pd.factorize(nodes["nuclearity"].astype(object))[0].astype(np.int32)
+        relation = pd.factorize(nodes["relation"].astype(object))[0].astype(np.int32)
+
+        spans = {}
+        order = np.argsort(annotator_codes, kind="stable")
+        bounds = np.searchsorted(annotator_codes[order], np.arange(annotator_count + 1))
+        for annotator in range(annotator_count):
+            rows = order[bounds[annotator]:bounds[annotator + 1]]
+            # a span annotated twice by the same annotator counts once, with the labels of its first node
+            annotator_keys, first = np.unique(span_keys[rows], return_index=True)
+            rows = rows[first]
+            spans[annotator] = (annotator_keys, nuclearity[rows], relation[rows], document_codes[rows])
+        return spans
+
+    def _pair_matches(self, spans: dict, pairs: list[tuple[int, int]]) -> list[dict]:
+        if self.max_workers == 1 or len(pairs) < 2:
+            _init_worker(spans)
+            return [_match_pair(a, b) for a, b in pairs]
+
+        workers = self.max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(pairs) // (workers * 4))
+        # the spans are sent once per process, the tasks only carry the annotator indices
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(spans,)) as executor:
+            return list(executor.map(_match_pair, *zip(*pairs), chunksize=chunksize))
+
+    @staticmethod
+    def _span_kappa(matched: int, size_a: int, size_b: int, candidates: int) -> float:
+        """Cohen's kappa of the yes/no decisions of both annotators over all candidate spans."""
+        if not candidates:
+            return np.nan
+        observed = (candidates - size_a - size_b + 2 * matched) / candidates
+        expected = (size_a / candidates) * (size_b / candidates) + (1 - size_a / candidates) * (1 - size_b / candidates)
+        return (observed - expected) / (1 - expected) if expected < 1 else np.nan
+
+
+def _init_worker(spans: dict) -> None:
+    global _annotator_spans
+    _annotator_spans = spans
+
+
+def _match_pair(a: int, b: int) -> dict[str, tuple[int, float]]:
+    """Intersects the spans of two annotators and returns `(matches, label kappa)` per agreement level."""
+    keys_a, nuclearity_a, relation_a, _ = _annotator_spans[a]
+    keys_b, nuclearity_b, relation_b, _ = _annotator_spans[b]
+    _, index_a, index_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+
+    labels_a = {'nuclearity': nuclearity_a[index_a], 'relation': relation_a[index_a]}
+    labels_b = {'nuclearity': nuclearity_b[index_b], 'relation': relation_b[index_b]}
+    # both labels at once, as a single code
+    relation_count = max(relation_a.max(initial=0), relation_b.max(initial=0)) + 2
+    labels_a['full'] = labels_a['nuclearity'].astype(np.int64) * relation_count + labels_a['relation'] + 1
+    labels_b['full'] = labels_b['nuclearity'].astype(np.int64) * relation_count + labels_b['relation'] + 1
+
+    matches = {'span': (len(index_a), np.nan)}
+    for level in ['nuclearity', 'relation', 'full']:
+        matches[level] = (int(np.count_nonzero(labels_a[level] == labels_b[level])), _label_kappa(labels_a[level], labels_b[level]))
+    return matches
+
+
+def _label_kappa(labels_a: np.ndarray, labels_b: np.ndarray) -> float:
+    """Cohen's kappa of two label arrays over the same items."""
+    if not len(labels_a):
+        return np.nan
+    _, codes = np.unique(np.concatenate([labels_a, labels_b]), return_inverse=True)
+    codes_a, codes_b = codes[:len(labels_a)], codes[len(labels_a):]
+    observed = np.mean(codes_a == codes_b)
+    expected = np.dot(np.bincount(codes_a, minlength=codes.max() + 1), np.bincount(codes_b, minlength=codes.max() + 1)) / len(labels_a) ** 2
+    return float((observed - expected) / (1 - expected)) if expected < 1 else np.nan
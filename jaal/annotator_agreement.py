@@ -1,69 +1,393 @@
+import numpy as np
 import pandas as pd
 
+# the agreement bitmask is a uint64, one bit per annotator
+MAX_ANNOTATORS = 64
+
+# agreement column of each granularity: the EDU span only, the span and nuclearity, or span, nuclearity and relation
+AGREEMENT_GRANULARITIES = {
+    'span': 'agreement_span',
+    'nuclearity': 'agreement_nuclearity',
+    'full': 'agreement',
+}
+
 class AnnotatorAgreement:
+    def __init__(self, annotators: list[str] | None = None):
+        """
+        Parameters
+        -------------
+        annotators: list[str] (optional)
+            fixed annotator index, annotator `i` is bit `1 << i` of the agreement bitmask. Keeps the bitmasks
+            comparable across frames; by default the sorted annotators of the frame passed to `find_agreements`
+        """
+        if annotators is not None and len(annotators) > MAX_ANNOTATORS:
+            raise ValueError(f"At most {MAX_ANNOTATORS} annotators are supported, got {len(annotators)}")
+        self.annotators = list(annotators) if annotators is not None else None
+        self._decoded: dict[int, list[str]] = {}
+
     def find_agreements(self, node_dataframe: pd.DataFrame) -> pd.DataFrame:
         """
-        Processes the input node and edge dataframes to compute, for each node, the list of annotators
+        Processes the input node and edge dataframes to compute, for each node, the set of annotators
         that agree on the node's annotation. The agreement is defined as having the same values for
-        'relation', 'nuclearity' and 'edus'. The result is a copy of the original node dataframe with
-        an additional column 'agreement'. Leaf nodes are assumed to be identical across annotators
-        and therefore will receive the full list of annotators.
+        'relation', 'nuclearity' and EDU span ('first_edu', 'last_edu' and 'edus'), within the same 'document'
+        if the frame holds several. The result is a copy of the original node dataframe with
+        an additional uint64 column 'agreement', the bitmask of the agreeing annotators over `self.annotators`
+        (0 for no agreement), see `decode_agreement`. Shared EDU leaves (without an annotator) are identical
+        across annotators and therefore will receive the full set of annotators. They count as a leaf of every
+        annotator of their document, as the annotators' own leaves do without `share_edus`.
+
+        For annotators whose segmentations differ, align the frame with `align_segments` first, the spans are
+        then compared on their shared token offsets ('first_token', 'last_token' and 'edu_tokens').
+
+        The coarser granularities of `AGREEMENT_GRANULARITIES` are computed in the same pass, agreement on the span
+        alone goes to 'agreement_span' and on span and nuclearity to 'agreement_nuclearity'.
         """
         # Make a copy of the node dataframe to avoid modifying the original.
         result_dataframe = node_dataframe.copy()
-        
-        # Compute the node signature as a tuple of (relation, nuclearity, edus) for each row.
-        result_dataframe["node_signature"] = result_dataframe.apply(
-            self._compute_node_signature, axis=1
-        )
-        
-        # Get the full list of annotators present in the data.
+
+        # Get the full list of annotators present in the data, unless the annotator index is fixed.
         all_annotators = self._get_all_annotators(result_dataframe)
-        
+        if self.annotators is None:
+            if len(all_annotators) > MAX_ANNOTATORS:
+                raise ValueError(f"At most {MAX_ANNOTATORS} annotators are supported, got {len(all_annotators)}")
+            self.annotators = all_annotators
+            self._decoded = {}
+        elif not set(all_annotators) <= set(self.annotators):
+            raise ValueError(f"Annotators missing from the annotator index: {sorted(set(all_annotators) - set(self.annotators))}")
+
+        # Hash the node signature (relation, nuclearity, EDU span) of every row into a single integer per granularity,
+        # all granularities are stacked into one frame.
+        node_signatures = self._compute_node_signatures(result_dataframe)
+        annotator_codes = pd.Categorical(result_dataframe["annotator"], categories=self.annotators).codes
+        annotated = np.flatnonzero(annotator_codes >= 0)
+        rows, codes = self._annotator_rows(result_dataframe, annotator_codes)
+        signatures = pd.DataFrame({
+            "node_signature": np.concatenate([node_signatures[granularity][rows] for granularity in AGREEMENT_GRANULARITIES]),
+            "annotator": np.tile(codes, len(AGREEMENT_GRANULARITIES)),
+        })
+
         # Compute an agreement mapping:
-        # For each unique node signature, determine the list of annotators that have that signature.
-        # For leaf nodes (is_leaf == True), we override with full agreement (all annotators),
-        # because it is known that the leaves are identical.
-        agreement_mapping = self._compute_agreement_mapping(result_dataframe, all_annotators)
-        
-        # Now assign the agreement list to every row, based on its node signature.
-        result_dataframe["agreement"] = result_dataframe["node_signature"].apply(
-            lambda signature: agreement_mapping.get(signature, [])
+        # For each unique node signature, determine the set of annotators that have that signature.
+        agreement_mapping = self._compute_agreement_mapping(signatures)
+
+        # EDU leaves shared between the annotators have no annotator of their own, everyone agrees on them.
+        shared_leaves = (result_dataframe["is_leaf"] & result_dataframe["annotator"].isna()).to_numpy()
+
+        # Now assign the agreement bitmask to every row, based on its node signature.
+        # (looked up by position, a join would turn the unmatched rows into float NaN and lose the high bits)
+        mapping_agreement = agreement_mapping["agreement"].to_numpy(dtype=np.uint64)
+        for granularity, column in AGREEMENT_GRANULARITIES.items():
+            mapping_positions = agreement_mapping.index.get_indexer(node_signatures[granularity][annotated])
+            agreement = np.zeros(len(result_dataframe), dtype=np.uint64)
+            agreement[annotated] = np.where(mapping_positions >= 0, mapping_agreement[mapping_positions], 0)
+            agreement[shared_leaves] = self.annotator_mask(all_annotators)
+            result_dataframe[column] = agreement
+
+        # keep the annotator index with the frame, for decoding the bitmasks later on
+        result_dataframe.attrs["annotators"] = list(self.annotators)
+
+        return result_dataframe
+
+    def find_subtree_agreements(self, node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Computes, for each node, the set of annotators whose whole subtree below the node is identical, from the
+        `TreeBuilder` node and edge frames (matched per 'document' if the frames hold several).
+
+        Every node gets a Merkle hash combining its own signature (relation, nuclearity, EDU span) with the hashes
+        of its children, computed bottom-up one tree level at a time; two subtrees are identical when their root
+        hashes are. Returns a copy of the node dataframe with the additional columns 'subtree_hash', the uint64
+        'subtree_agreement' bitmask (as 'agreement', see `decode_agreement`) and 'maximal_subtree', which flags the
+        roots of the maximal identical subtrees: internal nodes shared by some annotator their parent's subtree is not.
+        """
+        result_dataframe = node_dataframe.copy()
+        all_annotators = self._get_all_annotators(result_dataframe)
+        if self.annotators is None:
+            self.annotators = all_annotators
+            self._decoded = {}
+
+        child_rows, parent_rows = self._edge_rows(result_dataframe, edge_dataframe)
+        levels = result_dataframe["level"].to_numpy()
+        subtree_hashes = self._compute_subtree_hashes(
+            self._compute_node_signatures(result_dataframe)["full"], levels, child_rows, parent_rows
         )
-        
-        # Optionally drop the temporary 'node_signature' column.
-        result_dataframe.drop(columns=["node_signature"], inplace=True)
-        
+
+        # annotators sharing each subtree hash, in the same single grouped pass as the node signatures
+        annotator_codes = pd.Categorical(result_dataframe["annotator"], categories=self.annotators).codes
+        annotated = annotator_codes >= 0
+        annotator_sets = self._agreeing(self._compute_annotator_sets(pd.DataFrame({
+            "node_signature": subtree_hashes[annotated], "annotator": annotator_codes[annotated],
+        })))
+        subtree_agreement = np.zeros(len(result_dataframe), dtype=np.uint64)
+        subtree_agreement[annotated] = annotator_sets.to_numpy(dtype=np.uint64)[annotator_sets.index.get_indexer(subtree_hashes[annotated])]
+
+        # shared EDU leaves are the same subtree for everyone
+        shared_leaves = (result_dataframe["is_leaf"] & result_dataframe["annotator"].isna()).to_numpy()
+        subtree_agreement[shared_leaves] = self.annotator_mask(all_annotators)
+
+        parent_agreement = np.zeros(len(result_dataframe), dtype=np.uint64)
+        parent_agreement[child_rows] = subtree_agreement[parent_rows]
+
+        result_dataframe["subtree_hash"] = subtree_hashes
+        result_dataframe["subtree_agreement"] = subtree_agreement
+        # EDU leaves are identical by construction, only subtrees of internal nodes are reported
+        result_dataframe["maximal_subtree"] = ((subtree_agreement & ~parent_agreement) != 0) & ~result_dataframe["is_leaf"].to_numpy()
+        result_dataframe.attrs["annotators"] = list(self.annotators)
         return result_dataframe
 
-    def _compute_node_signature(self, row: pd.Series) -> tuple:
-        return (row["relation"], row["nuclearity"], tuple(row["edus"]))
+    def annotator_mask(self, annotators: list[str]) -> np.uint64:
+        """Returns the bitmask of the given annotators."""
+        mask = 0
+        for annotator in annotators:
+            mask |= 1 << self.annotators.index(annotator)
+        return np.uint64(mask)
+
+    def decode_agreement(self, agreement: int) -> list[str]:
+        """Returns the sorted names of the annotators in an agreement bitmask, e.g. for display."""
+        agreement = int(agreement)
+        names = self._decoded.get(agreement)
+        if names is None:
+            names = self._decoded[agreement] = [
+                annotator for position, annotator in enumerate(self.annotators) if agreement >> position & 1
+            ]
+        return names
+
+    def decode_agreements(self, agreement: pd.Series) -> pd.Series:
+        """Decodes a whole 'agreement' column to lists of names, decoding every distinct bitmask once."""
+        names = {mask: self.decode_agreement(mask) for mask in agreement.unique().tolist()}
+        return agreement.map(names)
+
+    def select_agreement(self, node_dataframe: pd.DataFrame, agreed_by: list[str] = [], not_agreed_by: list[str] = [], granularity: str = 'full') -> pd.Series:
+        """
+        Boolean mask of the agreed nodes that all annotators in `agreed_by` agree on, while none of `not_agreed_by`
+        does, e.g. the nodes agreed by A and B but not C. Runs as bitwise operations over the whole agreement
+        column of the given granularity (see `AGREEMENT_GRANULARITIES`), however many documents the frame holds.
+        """
+        agreement = node_dataframe[AGREEMENT_GRANULARITIES[granularity]].to_numpy(dtype=np.uint64)
+        required = self.annotator_mask(agreed_by)
+        excluded = self.annotator_mask(not_agreed_by)
+        selected = ((agreement & required) == required) & ((agreement & excluded) == 0) & (agreement != 0)
+        return pd.Series(selected, index=node_dataframe.index)
+
+    def _compute_node_signatures(self, dataframe: pd.DataFrame) -> dict[str, np.ndarray]:
+        """Hashes the signature of every row at each granularity of `AGREEMENT_GRANULARITIES` into a uint64.
+
+        The EDU span (with the 'document') is hashed once, nuclearity and then relation are mixed into it, so the
+        finer signatures cost one more column hash each.
+        """
+        span = pd.util.hash_pandas_object(_span_keys(dataframe), index=False).to_numpy()
+        nuclearity = _mix64(span ^ _mix64(pd.util.hash_pandas_object(dataframe["nuclearity"], index=False).to_numpy()))
+        full = _mix64(nuclearity ^ _mix64(pd.util.hash_pandas_object(dataframe["relation"], index=False).to_numpy()))
+        return {'span': span, 'nuclearity': nuclearity, 'full': full}
+
+    @staticmethod
+    def _edge_rows(node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """Row positions of the child and the parent node of every edge, edges to unknown nodes ('root') dropped."""
+        node_keys = node_dataframe["id"].astype(str)
+        edge_children = edge_dataframe["from"].astype(str)
+        edge_parents = edge_dataframe["to"].astype(str)
+        if "document" in node_dataframe.columns and "document" in edge_dataframe.columns:
+            node_keys = node_dataframe["document"].astype(str) + "\0" + node_keys
+            edge_children = edge_dataframe["document"].astype(str) + "\0" + edge_children
+            edge_parents = edge_dataframe["document"].astype(str) + "\0" + edge_parents
+
+        # shared EDU leaves may occur several times in the node frame, any of their rows will do
+        rows = pd.Series(np.arange(len(node_keys)), index=node_keys.to_numpy())
+        rows = rows[~rows.index.duplicated()]
+        child_rows = rows.index.get_indexer(edge_children.to_numpy())
+        parent_rows = rows.index.get_indexer(edge_parents.to_numpy())
+        known = (child_rows >= 0) & (parent_rows >= 0)
+        return rows.to_numpy()[child_rows[known]], rows.to_numpy()[parent_rows[known]]
+
+    @staticmethod
+    def _compute_subtree_hashes(signatures: np.ndarray, levels: np.ndarray, child_rows: np.ndarray, parent_rows: np.ndarray) -> np.ndarray:
+        """Merkle hashes of the subtrees below every node, deepest level first.
+
+        Each hash mixes the node's own signature with the sum of its children's hashes, which does not depend on
+        the order the children are listed in. Every edge is visited once, in the step of its child's level.
+        """
+        children_sums = np.zeros(len(signatures), dtype=np.uint64)
+        subtree_hashes = np.zeros(len(signatures), dtype=np.uint64)
+
+        order = np.argsort(-levels, kind="stable")
+        level_bounds = np.flatnonzero(np.diff(levels[order])) + 1
+        edge_order = np.argsort(-levels[child_rows], kind="stable")
+        child_rows, parent_rows = child_rows[edge_order], parent_rows[edge_order]
+        edge_levels = levels[child_rows]
+
+        for rows in np.split(order, level_bounds):
+            subtree_hashes[rows] = _mix64(signatures[rows] ^ _mix64(children_sums[rows]))
+            edges = slice(*np.searchsorted(-edge_levels, [-levels[rows[0]], -levels[rows[0]] + 1]))
+            np.add.at(children_sums, parent_rows[edges], subtree_hashes[child_rows[edges]])
+        return subtree_hashes
+
+    @staticmethod
+    def _annotator_rows(dataframe: pd.DataFrame, annotator_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The rows of the annotated nodes and their annotator codes, followed by the shared EDU leaves once for every
+        annotator of their document: a shared leaf stands for the leaf each annotator would otherwise have, which
+        spans of a single EDU are compared with."""
+        annotated = np.flatnonzero(annotator_codes >= 0)
+        shared_leaves = np.flatnonzero((dataframe["is_leaf"] & dataframe["annotator"].isna()).to_numpy())
+        if not shared_leaves.size:
+            return annotated, annotator_codes[annotated]
+
+        documents = pd.factorize(dataframe["document"].astype(str))[0] if "document" in dataframe.columns else np.zeros(len(dataframe), dtype=np.int64)
+        document_annotators = pd.DataFrame({"document": documents[annotated], "annotator": annotator_codes[annotated]}).drop_duplicates()
+        leaf_annotators = pd.DataFrame({"row": shared_leaves, "document": documents[shared_leaves]}).merge(document_annotators, on="document")
+        return (
+            np.concatenate([annotated, leaf_annotators["row"].to_numpy()]),
+            np.concatenate([annotator_codes[annotated], leaf_annotators["annotator"].to_numpy(dtype=annotator_codes.dtype)]),
+        )
 
     def _get_all_annotators(self, dataframe: pd.DataFrame) -> list:
-        annotators = dataframe["annotator"].unique().tolist()
+        annotators = dataframe["annotator"].dropna().unique().tolist()
         return sorted(annotators)
 
-    def _compute_agreement_mapping(self, dataframe: pd.DataFrame, full_annotator_list: list) -> dict:
-        """
-        For every unique node signature in the dataframe, determine the annotators that have
-        a node with that signature. For leaf nodes (where is_leaf is True), the agreement is
-        forced to the full list of annotators because they are known to be identical.
-        """
-        agreement_mapping = {}
-        
-        # Group the dataframe by the computed node signature.
-        grouped_by_signature = dataframe.groupby("node_signature")
-        
-        
-        # Process each group (each unique signature).
-        for signature, group in grouped_by_signature:
-            # Get a sorted list of annotators that have a node with this signature.
-            annotators_with_signature = sorted(group["annotator"].unique().tolist())
-            
-            # For internal nodes, require that at least two annotators have the same node.
-            if len(annotators_with_signature) >= 2:
-                agreement_mapping[signature] = annotators_with_signature
-            else:
-                agreement_mapping[signature] = []
-        
-        return agreement_mapping
+    def _compute_agreement_mapping(self, signatures: pd.DataFrame) -> pd.DataFrame:
+        """
+        For every unique node signature, determine the annotators that have a node with that signature.
+        `signatures` holds the 'node_signature' hash and the 'annotator' index (into `self.annotators`) of
+        every annotated node. Returns the agreement bitmasks indexed by signature, for the signatures that at
+        least two annotators agree on.
+        """
+        agreement = self._agreeing(self._compute_annotator_sets(signatures))
+        return agreement[agreement != 0].to_frame()
+
+    def _compute_annotator_sets(self, signatures: pd.DataFrame) -> pd.Series:
+        """The bitmask of the annotators of every unique node signature, indexed by the sorted signatures."""
+        # Collect the annotators of each signature as a bitmask in a single grouped pass.
+        signatures = signatures.drop_duplicates(["node_signature", "annotator"])
+        annotator_bits = np.left_shift(np.uint64(1), signatures["annotator"].to_numpy().astype(np.uint64))
+        return pd.Series(annotator_bits, index=signatures["node_signature"].to_numpy(), name="agreement").groupby(level=0).sum()
+
+    @staticmethod
+    def _agreeing(annotator_sets):
+        """Keeps the annotator sets of at least two annotators (`x & (x - 1)` clears the lowest bit), 0 otherwise."""
+        return annotator_sets * ((annotator_sets & (annotator_sets - np.uint64(1))) != 0)
+
+
+def _span_keys(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """The columns identifying the span of every row within its document.
+
+    Frames aligned by `align_segments` are compared on the shared token offsets, so annotators segmenting the text
+    differently still agree on the spans covering the same tokens; others on their EDU indices.
+    """
+    if "first_token" in dataframe.columns:
+        span_columns, explicit_column = ["first_token", "last_token"], "edu_tokens"
+    else:
+        span_columns, explicit_column = ["first_edu", "last_edu"], "edus"
+    keys = dataframe[[column for column in ["document", *span_columns] if column in dataframe.columns]].copy()
+
+    # the explicit EDUs are only filled for spans that are not contiguous, only those few lists are turned into strings
+    explicit_edus = dataframe[explicit_column].dropna()
+    keys["edus"] = pd.Series(
+        [",".join(map(str, edus)) for edus in explicit_edus], index=explicit_edus.index, dtype=object
+    ).reindex(dataframe.index, fill_value="")
+    return keys
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """The splitmix64 finalizer, scrambles every bit of a uint64 array into all others (wrapping arithmetic)."""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class AgreementIndex:
+    """Persistent index from node signatures to the set of annotators having them, kept alongside the node frame.
+
+    Replacing the nodes of one annotator (e.g. after one `.rs3` file was edited) only updates the annotator sets of
+    the signatures that annotator lost or gained, and only rewrites the agreement columns of the rows with those
+    signatures, instead of recomputing the agreement of the whole corpus. One index is kept per granularity of
+    `AGREEMENT_GRANULARITIES`.
+    """
+    def __init__(self, node_dataframe: pd.DataFrame, annotators: list[str] | None = None):
+        """
+        Parameters
+        -------------
+        node_dataframe: pandas dataframe
+            nodes of one or many documents, as passed to `AnnotatorAgreement.find_agreements`
+
+        annotators: list[str] (optional)
+            fixed annotator index of the agreement bitmasks, see `AnnotatorAgreement`
+        """
+        self.annotator_agreement = AnnotatorAgreement(annotators)
+        self.nodes = self.annotator_agreement.find_agreements(node_dataframe).reset_index(drop=True)
+        self.signatures = self.annotator_agreement._compute_node_signatures(self.nodes)
+
+        # sorted unique signatures and the bitmask of their annotators, per granularity
+        self._keys: dict[str, np.ndarray] = {}
+        self._annotator_sets: dict[str, np.ndarray] = {}
+        for granularity, signatures in self.signatures.items():
+            annotator_sets = self.annotator_agreement._compute_annotator_sets(self._signature_frame(self.nodes, signatures))
+            self._keys[granularity] = annotator_sets.index.to_numpy(dtype=np.uint64, copy=True)
+            self._annotator_sets[granularity] = annotator_sets.to_numpy(dtype=np.uint64, copy=True)
+
+    def replace_annotator(self, annotator: str, node_dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Replaces the nodes of `annotator` by its nodes in `node_dataframe` and updates the agreement incrementally.
+        With a 'document' column only the annotator's nodes of the documents in `node_dataframe` are replaced, all
+        of its nodes otherwise. Nodes of other annotators (and shared EDU leaves) in `node_dataframe` are ignored.
+        The replaced rows are removed and the new rows appended to `self.nodes`, which is returned.
+        """
+        annotator_bit = self.annotator_agreement.annotator_mask([annotator])
+        new_nodes = node_dataframe[node_dataframe["annotator"] == annotator]
+
+        old_rows = self.nodes["annotator"] == annotator
+        if "document" in new_nodes.columns and "document" in self.nodes.columns:
+            old_rows &= self.nodes["document"].isin(new_nodes["document"].unique())
+        old_rows = old_rows.to_numpy()
+        new_signatures = self.annotator_agreement._compute_node_signatures(new_nodes)
+
+        new_nodes = new_nodes.copy()
+        for column in AGREEMENT_GRANULARITIES.values():
+            new_nodes[column] = np.uint64(0)
+        self.nodes = self._concat_nodes(self.nodes[~old_rows], new_nodes)
+        annotated = self.nodes["annotator"].notna().to_numpy()
+
+        for granularity, column in AGREEMENT_GRANULARITIES.items():
+            keys, annotator_sets = self._keys[granularity], self._annotator_sets[granularity]
+            old_signatures = np.unique(self.signatures[granularity][old_rows])
+            added_signatures = np.unique(new_signatures[granularity])
+
+            # drop the annotator from the sets of the signatures it had, then add it to the ones it has now
+            annotator_sets[np.searchsorted(keys, old_signatures)] &= ~annotator_bit
+            unknown = added_signatures[~self._contains(keys, added_signatures)]
+            if unknown.size:
+                keys = np.concatenate([keys, unknown])
+                order = np.argsort(keys, kind="stable")
+                keys = keys[order]
+                annotator_sets = np.concatenate([annotator_sets, np.zeros(unknown.size, dtype=np.uint64)])[order]
+            annotator_sets[np.searchsorted(keys, added_signatures)] |= annotator_bit
+            self._keys[granularity], self._annotator_sets[granularity] = keys, annotator_sets
+
+            signatures = self.signatures[granularity] = np.concatenate([self.signatures[granularity][~old_rows], new_signatures[granularity]])
+
+            # rewrite the agreement of the rows whose signature gained or lost the annotator
+            affected = np.flatnonzero(np.isin(signatures, np.union1d(old_signatures, added_signatures)) & annotated)
+            agreement = self.nodes[column].to_numpy(dtype=np.uint64, copy=True)
+            agreement[affected] = self.annotator_agreement._agreeing(annotator_sets[np.searchsorted(keys, signatures[affected])])
+            self.nodes[column] = agreement
+        return self.nodes
+
+    @staticmethod
+    def _contains(keys: np.ndarray, signatures: np.ndarray) -> np.ndarray:
+        if not len(keys):
+            return np.zeros(len(signatures), dtype=bool)
+        return keys[np.minimum(np.searchsorted(keys, signatures), len(keys) - 1)] == signatures
+
+    def _signature_frame(self, nodes: pd.DataFrame, signatures: np.ndarray) -> pd.DataFrame:
+        annotator_codes = pd.Categorical(nodes["annotator"], categories=self.annotator_agreement.annotators).codes
+        rows, codes = self.annotator_agreement._annotator_rows(nodes, annotator_codes)
+        return pd.DataFrame({"node_signature": signatures[rows], "annotator": codes})
+
+    @staticmethod
+    def _concat_nodes(nodes: pd.DataFrame, new_nodes: pd.DataFrame) -> pd.DataFrame:
+        """Appends the new rows, widening the categories so categorical columns stay categorical."""
+        for column in nodes.columns:
+            if isinstance(nodes[column].dtype, pd.CategoricalDtype) and column in new_nodes.columns:
+                extra = pd.Index(new_nodes[column].dropna().unique()).difference(nodes[column].cat.categories)
+                nodes[column] = nodes[column].cat.add_categories(extra)
+                new_nodes[column] = pd.Categorical(new_nodes[column], categories=nodes[column].cat.categories)
+        combined = pd.concat([nodes, new_nodes], ignore_index=True)
+        combined.attrs = nodes.attrs
+        return combined
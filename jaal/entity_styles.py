@@ -5,6 +5,8 @@ HIGHLIGHTED_EDGE_COLOR = "#676767"
 
 EDU_BACKGROUND_COLOR = "#FFFFFF"
 HIGHLIGHTED_NODE_COLOR = "#dc143c"
+HIGHLIGHTED_SUBTREE_COLOR = "#1e90ff"
+SEARCH_MATCH_COLOR = "#ff8c00"
 
 DEFAULT_NODE_SIZE = 15
 
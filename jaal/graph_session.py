@@ -0,0 +1,328 @@
+"""
+Server-side graph state of the dashboard sessions
+
+The parsed graph of every view is immutable and shared by all sessions. Visibility and highlight styles of every
+node are precomputed per view for every value of the controls, as read-only arrays. A session only references the
+arrays its browser currently shows, and a callback compares them with the arrays of the new control values: the
+browser receives the changed node properties, applied through the `run` property of the visdcc network, instead
+of the whole graph.
+"""
+
+import json
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from jaal.jaal.node_search import NodeSearchIndex
+
+# node properties the highlight restyles, `hidden` is handled by the visibility masks
+HIGHLIGHT_KEYS = ("color", "borderWidth", "title")
+# sessions kept on the server, the least recently used one is dropped first
+DEFAULT_MAX_SESSIONS = 64
+# bytes of rendered graphs and update scripts kept by `RenderCache`
+DEFAULT_RENDER_CACHE_BYTES = 128 * 2**20
+
+
+def immutable_graph(graph_data):
+    """The graph with tuples of nodes and edges, the base graph callbacks overlay styles on but never change."""
+    return {"nodes": tuple(graph_data["nodes"]), "edges": tuple(graph_data["edges"])}
+
+
+class ViewMasks:
+    """Visibility mask of every annotator and highlight style of every agreement overlay, for the nodes of one view.
+
+    Styles are kept as integer codes into `styles`, the distinct `HIGHLIGHT_KEYS` values of the view, so an
+    overlay is one small integer array whatever the number of nodes. Every style also has the code of its search
+    highlight, nodes matching a search of `search_index` are restyled through it.
+    """
+    def __init__(self, graph_data, highlight_style, overlays, search_style=None):
+        """
+        Parameters
+        -------------
+        graph_data: dict{nodes, edges}
+            the parsed graph of the view, in format of visdcc, see `immutable_graph`
+
+        highlight_style: callable
+            `highlight_style(node, overlay, granularity)` returns the `HIGHLIGHT_KEYS` of a node under an overlay
+
+        overlays: list of (overlay, granularity)
+            the overlays precomputed in addition to no overlay at all
+
+        search_style: callable (optional)
+            `search_style(style)` returns the `HIGHLIGHT_KEYS` of a node matching a search from its style without
+            the search, matches are not highlighted if not given
+        """
+        self.graph_data = graph_data
+        nodes = graph_data["nodes"]
+        self.ids = np.array([node["id"] for node in nodes], dtype=object)
+        # nodes without annotator (shared EDU leaves) belong to every annotator
+        annotators = np.array([node.get("annotator") if isinstance(node.get("annotator"), str) else "" for node in nodes], dtype=object)
+        self._annotators = annotators
+        self._visible = {"All": np.ones(len(nodes), dtype=bool)}
+        for annotator in np.unique(annotators[annotators != ""]).tolist():
+            self.visibility(annotator)
+        self.parsed_visible = np.array([not node.get("hidden") for node in nodes], dtype=bool)
+        self.parsed_visible.flags.writeable = False
+
+        self.styles = []
+        style_codes = {}
+
+        def style_code(style):
+            key = json.dumps(style, sort_keys=True, default=str)
+            if key not in style_codes:
+                style_codes[key] = len(self.styles)
+                self.styles.append(style)
+            return style_codes[key]
+
+        self._overlays = {}
+        for overlay, granularity in [(False, None), *overlays]:
+            codes = np.empty(len(nodes), dtype=np.int64)
+            for index, node in enumerate(nodes):
+                codes[index] = style_code(highlight_style(node, overlay, granularity))
+            codes.flags.writeable = False
+            self._overlays[(overlay, granularity) if overlay else (False, None)] = codes
+
+        self.search_index = NodeSearchIndex(nodes)
+        self._search_codes = np.arange(len(self.styles))
+        if search_style is not None:
+            self._search_codes = np.array([style_code(search_style(style)) for style in list(self.styles)], dtype=np.int64)
+
+    def visibility(self, annotator):
+        """The mask of the nodes shown for `annotator` ('All' or `None`, no annotator selected, for every annotator)."""
+        if annotator is None:
+            annotator = "All"
+        visible = self._visible.get(annotator)
+        if visible is None:
+            visible = (self._annotators == annotator) | (self._annotators == "")
+            visible.flags.writeable = False
+            self._visible[annotator] = visible
+        return visible
+
+    def overlay(self, overlay, granularity):
+        """The style codes of the nodes under the agreement overlay at `granularity`."""
+        return self._overlays.get(overlay_key(overlay, granularity), self._overlays[(False, None)])
+
+    def styled(self, overlay, granularity, search_rows=()):
+        """The style codes of `overlay` with the nodes at `search_rows`, the matches of a search, highlighted."""
+        codes = self.overlay(overlay, granularity)
+        rows = np.asarray(search_rows, dtype=np.int64)
+        if len(rows):
+            codes = codes.copy()
+            codes[rows] = self._search_codes[codes[rows]]
+            codes.flags.writeable = False
+        return codes
+
+
+def overlay_key(overlay, granularity):
+    """`(overlay, granularity)` with the granularity dropped when there is no overlay, it makes no difference then."""
+    return (True, granularity) if overlay else (False, None)
+
+
+class GraphSession:
+    """The graph one browser session shows, as the view's `ViewMasks` and the arrays currently applied.
+
+    The arrays are the read-only ones of `ViewMasks`, a session holds no node data of its own.
+    """
+    def __init__(self, view_masks, view=None):
+        """
+        Parameters
+        -------------
+        view_masks: ViewMasks
+            the precomputed masks of the view the browser shows
+
+        view: str (optional)
+            the tree view of the graph, `None` for the graph the dashboard opens with
+        """
+        self.view = view
+        self.masks = view_masks
+        self.visible = view_masks.parsed_visible
+        self.style_codes = view_masks.overlay(False, None)
+        # controls the arrays were picked for, `None` for the parsed visibility
+        self.annotator = None
+        self.overlay = (False, None)
+        # the normalized search text and the rows of its matches, kept per session as callbacks run concurrently
+        self.search = ""
+        self.search_rows = np.empty(0, dtype=np.int64)
+
+    def show(self, annotator, overlay, granularity, search=""):
+        """Moves to the arrays of the given controls without computing what changed."""
+        self.visible, self.annotator = self.masks.visibility(annotator), annotator
+        self.overlay = overlay_key(overlay, granularity)
+        self.search_for(search)
+        self.style_codes = self.styled(overlay, granularity)
+
+    def search_for(self, search):
+        """Sets the normalized search text, its matches are only searched again when the text changes."""
+        if search != self.search:
+            self.search = search
+            self.search_rows = self.masks.search_index.search(search) if search else np.empty(0, dtype=np.int64)
+
+    def styled(self, overlay, granularity):
+        """The style codes of `overlay` with the matches of the session's search highlighted, see `ViewMasks.styled`."""
+        return self.masks.styled(overlay, granularity, self.search_rows)
+
+    def set_visible(self, visible):
+        """Applies a visibility mask, returns the `(properties, node ids)` groups of the nodes that changed."""
+        changed = visible != self.visible
+        self.visible = visible
+        return [({"hidden": not value}, self.masks.ids[changed & (visible == value)].tolist()) for value in (False, True) if np.any(changed & (visible == value))]
+
+    def set_styles(self, style_codes):
+        """Applies highlight style codes, returns the `(properties, node ids)` groups of the nodes that changed.
+
+        Only the properties that differ between a node's previous and new style are sent, a property the new
+        style does not have as `None`, which removes it in the browser.
+        """
+        changed = np.flatnonzero(style_codes != self.style_codes)
+        previous_codes, codes = self.style_codes[changed], style_codes[changed]
+        self.style_codes = style_codes
+
+        groups = []
+        pairs, inverse = np.unique(previous_codes * len(self.masks.styles) + codes, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        for pair, pair_changed in zip(pairs.tolist(), np.split(changed[order], np.cumsum(np.bincount(inverse))[:-1])):
+            previous_style, style = self.masks.styles[pair // len(self.masks.styles)], self.masks.styles[pair % len(self.masks.styles)]
+            properties = {key: style.get(key) for key in HIGHLIGHT_KEYS if style.get(key) != previous_style.get(key)}
+            groups.append((properties, self.masks.ids[pair_changed].tolist()))
+        return groups
+
+    def graph_data(self):
+        """The whole graph with the session's visibility and styles, to send when the browser gets a new graph.
+
+        Nodes shown as parsed are the base nodes themselves, only the others are overlaid on a shallow copy.
+        """
+        nodes = list(self.masks.graph_data["nodes"])
+        base_codes = self.masks.overlay(False, None)
+        for index in np.flatnonzero((self.visible != self.masks.parsed_visible) | (self.style_codes != base_codes)).tolist():
+            node = {key: value for key, value in nodes[index].items() if key not in HIGHLIGHT_KEYS}
+            node.update((key, value) for key, value in self.masks.styles[self.style_codes[index]].items() if value is not None)
+            node["hidden"] = not self.visible[index]
+            nodes[index] = node
+        return {"nodes": nodes, "edges": self.masks.graph_data["edges"]}
+
+
+class GraphSessions:
+    """The `GraphSession` of every browser session, bounded to the `max_sessions` most recently used.
+
+    Callbacks of different requests run in concurrent threads, every access to the sessions holds a lock.
+    """
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new(self, view_masks, view=None):
+        """Registers a session showing the parsed graph of `view_masks` and returns its id."""
+        session_id = uuid.uuid4().hex
+        self[session_id] = GraphSession(view_masks, view)
+        return session_id
+
+    def get(self, session_id):
+        """The session of `session_id`, `None` if it is unknown or was dropped."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class RenderCache:
+    """Bounded LRU of rendered graphs and update scripts, keyed by the control combination they render.
+
+    Values are strings or bytes, the least recently used ones are dropped once they take more than `max_bytes`.
+    Every access holds a lock, as callbacks of different requests run in concurrent threads. Rendering does not:
+    two requests missing the same key may both render it.
+    """
+    def __init__(self, max_bytes=DEFAULT_RENDER_CACHE_BYTES):
+        """
+        Parameters
+        -------------
+        max_bytes: int (optional)
+            memory budget of the cached values (default: 128 MiB), 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The value of `key`, `None` on a miss."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def get_or_render(self, key, render):
+        """The value of `key`, rendered by `render()` and cached on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self.size}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def graph_payload(graph_data):
+    """The graph as JSON bytes, served to the browser as it is."""
+    return json.dumps(graph_data, separators=(",", ":"), default=str).encode()
+
+
+# scripts run one after the other, an update never overtakes a graph still being fetched
+_QUEUE_SCRIPT = "this.jaalQueue = (this.jaalQueue || Promise.resolve()).then({}).catch((error) => console.log(error))"
+
+
+def update_script(groups):
+    """JavaScript for the `run` property of the visdcc network, applying `(properties, node ids)` groups to its nodes."""
+    payload = ",".join(
+        f"[{json.dumps(properties, separators=(',', ':'))},{json.dumps(ids, separators=(',', ':'))}]" for properties, ids in groups
+    )
+    return _QUEUE_SCRIPT.format(
+        f"() => [{payload}].forEach(([properties, ids]) => this.nn.update(ids.map((id) => Object.assign({{id: id}}, properties))))"
+    )
+
+
+def graph_script(url):
+    """JavaScript for the `run` property of the visdcc network, replacing its graph by the one served at `url`."""
+    return _QUEUE_SCRIPT.format(
+        f"() => fetch({json.dumps(url)}).then((response) => response.json()).then((graph) => "
+        "{ this.nn.clear(); this.ee.clear(); this.nn.add(graph.nodes); this.ee.add(graph.edges); })"
+    )
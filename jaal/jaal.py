@@ -4,21 +4,39 @@ Author: Mohit Mayank
 Main class for Jaal network visualization dashboard
 """
 
-import copy
 import json
 import logging
+import uuid
+from urllib.parse import urlencode
 
 import dash
 import dash_bootstrap_components as dbc
+import flask
 import pandas as pd
+import plotly.graph_objects as go
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
+from jaal.jaal.annotator_agreement import AGREEMENT_GRANULARITIES, AnnotatorAgreement
 from jaal.jaal.entity_styles import (
     DEFAULT_EDGE_COLOR,
     HIGHLIGHTED_NODE_COLOR,
+    HIGHLIGHTED_SUBTREE_COLOR,
+    SEARCH_MATCH_COLOR,
     EntityType,
 )
+from jaal.jaal.graph_session import (
+    DEFAULT_RENDER_CACHE_BYTES,
+    GraphSession,
+    GraphSessions,
+    RenderCache,
+    ViewMasks,
+    graph_payload,
+    graph_script,
+    immutable_graph,
+    overlay_key,
+    update_script,
+)
 from jaal.jaal.layout_ import (
     DEFAULT_BORDER_SIZE,
     DEFAULT_EDGE_SIZE,
@@ -29,6 +47,7 @@ from jaal.jaal.layout_ import (
     get_app_layout,
     get_distinct_colors,
 )
+from jaal.jaal.node_search import normalize_text
 from jaal.jaal.parse_dataframe import parse_dataframe
 from utils import DEFAULT_OPTIONS, OVERLAY_OPTIONS
 
@@ -40,7 +59,7 @@ _LOGGER = logging.getLogger(__name__)
 class Jaal:
     """The main visualization class"""
 
-    def __init__(self, edge_df, node_df=None):
+    def __init__(self, edge_df, node_df=None, views=None, cube=None, render_cache_bytes=DEFAULT_RENDER_CACHE_BYTES):
         """
         Parameters
         -------------
@@ -49,27 +68,78 @@ class Jaal:
 
         node_df: pandas dataframe (optional)
             The network node data stored in format of pandas dataframe
+
+        views: dict (optional)
+            `{view: {'edges': edge_df, 'nodes': node_df}}` of every tree view the view toggle switches between, e.g.
+            the 'constituent' and 'rst' frames of `RS3Parser.parse_files_views`, which returns them as
+            `(node_df, edge_df)` tuples
+
+        cube: AgreementCube (optional)
+            precomputed agreement counts of a whole corpus, shown as heatmaps on the '/cube' page
+
+        render_cache_bytes: int (optional)
+            memory budget of the rendered graphs and updates cached per control combination (default: 128 MiB),
+            see `RenderCache`
         """
         _LOGGER.debug("Parsing the data...")
-        self.data, self.scaling_vars = parse_dataframe(edge_df, node_df)
-        self.filtered_data = self.data.copy()
-        self.original_data = self._set_default_styles(copy.deepcopy(self.data))
+        # graph data of every view, parsed once so switching views is a lookup
+        self.views = {}
+        default_view = None
+        for view, frames in (views or {}).items():
+            graph_data, scaling_vars = parse_dataframe(frames["edges"], frames["nodes"])
+            self.views[view] = immutable_graph(self._set_default_styles(graph_data))
+            # the graph the dashboard opens with is usually one of the views, it is not parsed a second time
+            if default_view is None and frames["edges"] is edge_df and frames["nodes"] is node_df:
+                default_view, self.scaling_vars = view, scaling_vars
+        # the parsed graphs are never changed, callbacks overlay styles on them (see `ViewMasks`)
+        if default_view is None:
+            self.data, self.scaling_vars = parse_dataframe(edge_df, node_df)
+            self.data = immutable_graph(self._set_default_styles(self.data))
+        else:
+            self.data = self.views[default_view]
+        # decodes the 'agreement' bitmasks to annotator names for display
+        annotators = node_df.attrs.get("annotators") if node_df is not None else None
+        if annotators is None and node_df is not None and "annotator" in node_df.columns:
+            annotators = sorted(node_df["annotator"].dropna().unique().tolist())
+        self.annotator_agreement = AnnotatorAgreement(annotators)
+        # visibility of every annotator and highlight of every agreement overlay, precomputed per view (`None` for the
+        # graph the dashboard opens with, which shares the masks of its view) so callbacks only pick arrays
+        overlays = [(True, granularity) for granularity in AGREEMENT_GRANULARITIES]
+        self.view_masks = {
+            view: ViewMasks(graph_data, self._highlight_style, overlays, self._search_style) for view, graph_data in self.views.items()
+        }
+        self.view_masks[None] = self.view_masks[default_view] if default_view is not None else ViewMasks(
+            self.data, self._highlight_style, overlays, self._search_style
+        )
+        self.cube = cube
+        # graph state of every browser session, callbacks send only what changed to the browser
+        self.sessions = GraphSessions()
+        # graphs and updates already rendered for a control combination, the token tells the graphs of this
+        # instance apart in the browser's HTTP cache
+        self.render_cache = RenderCache(render_cache_bytes)
+        self._render_token = uuid.uuid4().hex[:12]
         self.node_value_color_mapping = {}
         self.edge_value_color_mapping = {}
         _LOGGER.debug("Done")
 
-    def _callback_search_graph(self, graph_data, search_text):
-        """Hide the nodes unrelated to search quiery"""
-        nodes = graph_data['nodes']
-        for node in nodes:
-            if search_text.lower() not in node['label'].lower():
-                node["color"] = {"border": HIGHLIGHTED_EDGE_COLOR}
-                node["borderWidth"] = DEFAULT_BORDER_SIZE + 2
-            else:
-                node["color"] = {"border": DEFAULT_EDGE_COLOR}
-                node["borderWidth"] = DEFAULT_BORDER_SIZE
-        graph_data['nodes'] = nodes
-        return graph_data
+    def _callback_search_graph(self, session, search_text):
+        """Highlights the nodes whose label or EDU text matches the search, see `NodeSearchIndex`.
+
+        Only the nodes whose style changes are returned: the matches of the previous search and of the new one.
+        """
+        _LOGGER.debug("_callback_search_graph: %s", search_text)
+        session.search_for(normalize_text(search_text) if search_text else "")
+        overlay, granularity = session.overlay
+        return session.set_styles(session.styled(overlay, granularity))
+
+    def _search_style(self, style):
+        """The style of a node matching the search, its fill and title are kept."""
+        color = style.get("color")
+        if isinstance(color, dict):
+            color = {**color, "border": SEARCH_MATCH_COLOR}
+        else:
+            color = {"border": SEARCH_MATCH_COLOR, **({"background": color} if color else {})}
+        return {**style, "color": color, "borderWidth": DEFAULT_BORDER_SIZE + 4}
 
     def _set_default_styles(self, graph_data):
         """Set the graph style to the defaults."""
@@ -100,48 +170,108 @@ class Jaal:
         #     if "level" in node:
         #         node["level"] = self._get_aligned_level(node["id"])  # 🔥 Ensure level alignment
 
-        # Adjust layout settings for proper overlaying
-        updated_options = OVERLAY_OPTIONS.copy()
-        updated_options["layout"]["hierarchical"].update({
+        # Adjust layout settings for proper overlaying, on new dicts so OVERLAY_OPTIONS is left as it is
+        hierarchical = {
+            **OVERLAY_OPTIONS["layout"]["hierarchical"],
             "treeSpacing": 0,  # Bring trees together
             "nodeSpacing": 10,  # Minimize spacing for better overlay
             "parentCentralization": True,  # Align roots together
             "blockShifting": False,  # Prevent shifting nodes sideways
             "edgeMinimization": True,  # Reduce edge overlap
-        })
+        }
+        updated_options = {**OVERLAY_OPTIONS, "layout": {**OVERLAY_OPTIONS["layout"], "hierarchical": hierarchical}}
 
         return graph_data, updated_options
     
-    def _callback_agreement(self, graph_data, overlay):
-        print(f"_callback_agreement: {overlay}")
-        for node in graph_data['nodes']:
-            if overlay:
-                if node["agreement"] and not node["is_leaf"]:
-                    node["color"] = {"border": HIGHLIGHTED_NODE_COLOR}
-                    node["borderWidth"] = DEFAULT_BORDER_SIZE + 2
-                    node["title"] = node["agreement"]
-                    # node["label"] = node["agreement"]
-                    # node["color"] = HIGHLIGHTED_NODE_COLOR
-                    # node["color"] = HIGHLIGHTED_NODE_COLOR
-            else:
-                # node["color"] = {"border": DEFAULT_EDGE_COLOR}
-                # node["borderWidth"] = DEFAULT_BORDER_SIZE
-                return self.data
-
-        return graph_data
+    def _highlight_style(self, node, overlay, granularity='full'):
+        """The color, borderWidth and title of a node, highlighted if several annotators agree on it at the given
+        granularity, see `AGREEMENT_GRANULARITIES`."""
+        style = {key: node.get(key) for key in ("color", "borderWidth", "title")}
+        if not overlay or node.get("is_leaf"):
+            return style
+        column = AGREEMENT_GRANULARITIES.get(granularity, "agreement")
+        if node.get(column):
+            style["color"] = {"border": HIGHLIGHTED_NODE_COLOR}
+            style["borderWidth"] = DEFAULT_BORDER_SIZE + 2
+            style["title"] = ", ".join(self.annotator_agreement.decode_agreement(node[column]))
+        # whole subtrees several annotators agree on, see AnnotatorAgreement.find_subtree_agreements
+        if granularity == 'full' and node.get("subtree_agreement"):
+            style["color"] = {"border": HIGHLIGHTED_SUBTREE_COLOR}
+            style["borderWidth"] = DEFAULT_BORDER_SIZE + 2
+            if node.get("maximal_subtree"):
+                style["borderWidth"] = DEFAULT_BORDER_SIZE + 4
+                style["title"] = "Identical subtree: " + ", ".join(self.annotator_agreement.decode_agreement(node["subtree_agreement"]))
+        return style
+
+    def _callback_agreement(self, session, overlay, granularity='full'):
+        """Highlights the nodes several annotators agree on at the given granularity, see `AGREEMENT_GRANULARITIES`.
+
+        All granularities are precomputed style codes of `ViewMasks`, so switching only picks another array.
+        """
+        _LOGGER.debug("_callback_agreement: %s, %s", overlay, granularity)
+        session.overlay = overlay_key(overlay, granularity)
+        return session.set_styles(session.styled(overlay, granularity))
 
-    def _callback_select_annotator(self, graph_data, annotator):
+    def _callback_select_annotator(self, session, annotator):
         print(f"_callback_select_annotator: {annotator}")
-        for node in graph_data['nodes']:
-            if annotator == 'All' or node['annotator'] == annotator:
-                node['hidden'] = False
-            elif node['annotator'] != annotator:
-                node['hidden'] = True
-        return graph_data
-    
-    def _callback_tree_type(self, graph_data, tree_type):
+        session.annotator = annotator
+        return session.set_visible(session.masks.visibility(annotator))
+
+    def _callback_tree_type(self, tree_type):
         print(f"_callback_tree_type: {tree_type}")
-        return graph_data
+        return self.view_masks.get(tree_type, self.view_masks[None])
+
+    def _graph_payload(self, tree_type, annotator, overlay, granularity, search=""):
+        """The JSON of the whole graph for a control combination, rendered once and then served from `render_cache`."""
+        def render():
+            session = GraphSession(self._callback_tree_type(tree_type), tree_type)
+            session.show(annotator, overlay, granularity, search)
+            return graph_payload(session.graph_data())
+
+        return self.render_cache.get_or_render(("graph", tree_type, annotator, overlay_key(overlay, granularity), search), render)
+
+    def _callback_update_graph(self, session, annotator, overlay, granularity, search=""):
+        """The script updating the browser from the session's controls to the given ones, cached per combination."""
+        key = (
+            "update", session.view, session.annotator, session.overlay, session.search,
+            annotator, overlay_key(overlay, granularity), search,
+        )
+        script = self.render_cache.get(key)
+        if script is None:
+            node_updates = (
+                self._callback_search_graph(session, search)
+                + self._callback_agreement(session, overlay, granularity)
+                + self._callback_select_annotator(session, annotator)
+            )
+            script = update_script(node_updates) if node_updates else ""
+            self.render_cache.put(key, script)
+        else:
+            session.show(annotator, overlay, granularity, search)
+        return script
+
+    def _callback_cube_heatmap(self, index, columns, metric, granularity, documents_text, relations, annotator_pairs):
+        """Slices the heatmap from the agreement cube, the node data is not touched."""
+        if not index or not columns or index == columns:
+            raise PreventUpdate
+        documents = None
+        if documents_text:
+            document_names = pd.Index(self.cube.categories("document"))
+            documents = document_names[document_names.str.contains(documents_text, regex=False)].tolist()
+        values = self.cube.pivot(
+            index, columns, metric or "f1", granularity, documents=documents, relations=relations or None, annotator_pairs=annotator_pairs or None
+        )
+        ratio = metric in ("f1", "precision", "recall")
+        figure = go.Figure(go.Heatmap(
+            z=values.to_numpy(),
+            x=values.columns.astype(str).tolist(),
+            y=values.index.astype(str).tolist(),
+            colorscale="Blues",
+            zmin=0 if ratio else None,
+            zmax=1 if ratio else None,
+            hovertemplate=f"{index}: %{{y}}<br>{columns}: %{{x}}<br>{metric}: %{{z:.3f}}<extra></extra>",
+        ))
+        figure.update_layout(margin={"l": 40, "r": 20, "t": 40, "b": 40}, title=f"{metric} ({granularity})", yaxis={"autorange": "reversed"})
+        return figure
 
     def get_color_popover_legend_children(self, node_value_color_mapping=None, edge_value_color_mapping=None):
         """Get the popover legends for node and edge based on the color setting"""
@@ -196,10 +326,14 @@ class Jaal:
         # create the app
         app = dash.dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
-        # define layout
-        app.layout = get_app_layout(  # type: ignore[misc]
-            self.data, color_legends=self.get_color_popover_legend_children(), directed=directed, vis_opts=vis_opts
-        )
+        # define layout, every page load gets a session of its own showing the graph the layout opens with
+        def serve_layout():
+            return get_app_layout(
+                self.data, color_legends=self.get_color_popover_legend_children(), directed=directed, vis_opts=vis_opts, cube=self.cube,
+                session_id=self.sessions.new(self.view_masks[None]),
+            )
+
+        app.layout = serve_layout  # type: ignore[misc]
 
         # create callbacks to toggle hide/show sections - FILTER section
         @app.callback(
@@ -212,52 +346,97 @@ class Jaal:
                 return not is_open
             return is_open
         
+        # whole graphs are fetched from here by the browser, the callback response only holds the url
+        graph_path = "_jaal/graph"
+
+        @app.server.route(app.config.routes_pathname_prefix + graph_path)
+        def serve_graph():
+            arguments = flask.request.args
+            payload = self._graph_payload(
+                arguments.get("view"), arguments.get("annotator"), arguments.get("overlay") == "1", arguments.get("granularity"),
+                normalize_text(arguments.get("search", "")),
+            )
+            return flask.Response(payload, mimetype="application/json", headers={"Cache-Control": "private, max-age=86400"})
+
+        # typing restarts the search timer, the text is searched once it fires: at most once per interval, and
+        # always for the last text typed. Both run in the browser, keystrokes never reach the server
+        app.clientside_callback(
+            "function(value) { return 0; }",
+            Output("search_timer", "n_intervals"),
+            [Input("search_graph", "value")],
+            prevent_initial_call=True,
+        )
+        app.clientside_callback(
+            "function(n_intervals, value) { return n_intervals ? (value || '') : window.dash_clientside.no_update; }",
+            Output("search_query", "data"),
+            [Input("search_timer", "n_intervals")],
+            [State("search_graph", "value")],
+            prevent_initial_call=True,
+        )
+
         @app.callback(
-            Output("graph", "data"),
+            Output("graph", "run"),
             [
                 Input("overlay_checkbox", "checked"),
                 Input("annotator", "value"),
                 Input("view_toggle", "value"),
+                Input("agreement_granularity", "value"),
+                Input("search_query", "data"),
             ],
-            [
-                State("graph", "data"),
-                # State("graph", "options"),
-            ],
+            [State("session_id", "data")],
         )
-        def update_graph(overlay, annotator, tree_type, graph_data):
+        def update_graph(overlay, annotator, tree_type, granularity, search_text, session_id):
             ctx = dash.callback_context
 
             if not ctx.triggered:
                 raise PreventUpdate
 
             input_id = ctx.triggered[0]["prop_id"].split(".")[0]
-
-            # graph_data = self.enforce_leaf_order(graph_data)
-            # updated_options = current_options.copy()  # <<<<< Ensure we modify a copy
-
-            if input_id == "overlay_checkbox":
-                graph_data = self._callback_agreement(graph_data, overlay)
-                # print(graph_data["nodes"])
-
-
-            elif input_id == "annotator":
-                graph_data = self._callback_select_annotator(graph_data, annotator)
-
-            elif input_id == "view_toggle":
-                graph_data = self._callback_tree_type(copy.deepcopy(self.original_data), tree_type)
-
-            else:
-                graph_data = self.data
-                # self.enforce_leaf_order(graph_data)
-
-            # graph_data = copy.deepcopy(self.original_data)
-            # elif input_id == "search_graph":
-            #     if n_clicks_search > 0 and search_text:
-            #         graph_data = self._callback_search_graph(copy.deepcopy(self.original_data), search_text)
-            #     else:
-            #         graph_data = copy.deepcopy(self.original_data)
-
-            return graph_data  # <<<<< Ensure options are updated
+            session = self.sessions.get(session_id)
+            search = normalize_text(search_text) if search_text else ""
+
+            # a new view, or a session the server no longer knows: the browser fetches the whole graph once
+            if input_id == "view_toggle" or session is None:
+                session = GraphSession(self._callback_tree_type(tree_type), tree_type)
+                if session_id is not None:
+                    self.sessions[session_id] = session
+                session.show(annotator, overlay, granularity, search)
+                arguments = {
+                    "view": tree_type, "annotator": annotator, "overlay": int(bool(overlay)), "granularity": granularity,
+                    "search": search or None, "v": self._render_token,
+                }
+                return graph_script(app.get_relative_path("/" + graph_path) + "?" + urlencode({key: value for key, value in arguments.items() if value is not None}))
+
+            # otherwise only the changed node properties
+            script = self._callback_update_graph(session, annotator, overlay, granularity, search)
+            if not script:
+                raise PreventUpdate
+            return script
+
+        if self.cube is not None:
+            @app.callback(
+                [Output("graph_page", "style"), Output("cube_page", "style")],
+                [Input("url", "pathname")],
+            )
+            def show_page(pathname):
+                if pathname == "/cube":
+                    return {"display": "none"}, {"display": "block"}
+                return {"display": "block"}, {"display": "none"}
+
+            @app.callback(
+                Output("cube_heatmap", "figure"),
+                [
+                    Input("cube_index", "value"),
+                    Input("cube_columns", "value"),
+                    Input("cube_metric", "value"),
+                    Input("cube_granularity", "value"),
+                    Input("cube_documents", "value"),
+                    Input("cube_relations", "value"),
+                    Input("cube_pairs", "value"),
+                ],
+            )
+            def update_cube_heatmap(index, columns, metric, granularity, documents_text, relations, annotator_pairs):
+                return self._callback_cube_heatmap(index, columns, metric, granularity, documents_text, relations, annotator_pairs)
 
         return app
 
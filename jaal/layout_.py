@@ -13,8 +13,9 @@ import pathlib
 import dash_bootstrap_components as dbc
 import pandas as pd
 import visdcc
-from dash import html
+from dash import dcc, html
 
+from jaal.jaal.agreement_cube import CUBE_DIMENSIONS, CUBE_METRICS
 from utils import DEFAULT_OPTIONS
 
 # Constants
@@ -29,6 +30,9 @@ DEFAULT_NODE_COLOR = '#97C2FC'
 DEFAULT_EDGE_COLOR = '#FFFFFF'
 HIGHLIGHTED_EDGE_COLOR = '#FF6800'
 
+# milliseconds of typing coalesced into one graph search
+SEARCH_DEBOUNCE_MS = 250
+
 # Taken from https://stackoverflow.com/questions/470690/how-to-automatically-generate-n-distinct-colors
 KELLY_COLORS_HEX = [
     "#FFB300",  # Vivid Yellow
@@ -101,7 +105,7 @@ def create_row(children, style=_FLEX_ROW_STYLE):
     return dbc.Row(children, style=style, className="column flex-display")
 
 
-def get_select_form_layout(id, options, label, description):
+def get_select_form_layout(id, options, label, description, value=None):
     """Creates a select (dropdown) form with provides details
 
     Parameters
@@ -114,13 +118,15 @@ def get_select_form_layout(id, options, label, description):
         label of the select dropdown bar
     description: str
         long text detail of the setting
+    value: str (optional)
+        initially selected option
     """
     return dbc.Form(
         [
             dbc.InputGroup(
                 [
                     dbc.InputGroupText(label),
-                    dbc.Select(id=id, options=options),
+                    dbc.Select(id=id, options=options, value=value),
                 ]
             ),
             dbc.FormText(description, color="secondary"),
@@ -135,6 +141,9 @@ search_form = dbc.FormGroup(
             "Show the node you are looking for",
             color="secondary",
         ),
+        # the text typed is searched when the timer fires, see Jaal.create
+        dcc.Interval(id="search_timer", interval=SEARCH_DEBOUNCE_MS, n_intervals=1, max_intervals=1),
+        dcc.Store(id="search_query"),
     ],
     style={
         "width": "96%",
@@ -258,6 +267,33 @@ common_nodes_form = dbc.Form(
             ],
             align="center",
         ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dbc.RadioItems(
+                        id="agreement_granularity",
+                        options=[
+                            {"label": "Span", "value": "span"},
+                            {"label": "+Nuclearity", "value": "nuclearity"},
+                            {"label": "Full", "value": "full"}
+                        ],
+                        value="full",  # span, nuclearity and relation
+                        inline=True,
+                        labelStyle={
+                            "font-size": "0.8rem",
+                            "color": "secondary",
+                            "margin-right": "5px"
+                        },
+                        style={
+                            "margin-top": "0.25em",
+                            "margin-left": "5px",
+                        },
+                    ),
+                    width="auto",
+                ),
+            ],
+            align="center",
+        ),
     ],
     style={
         "margin-top": "10px",
@@ -309,7 +345,7 @@ toggle_view_form = dbc.Form(
                             {"label": "Constituent", "value": "constituent"},
                             {"label": "RST", "value": "rst"}
                         ],
-                        value="new",  # "New" selected by default
+                        value="constituent",  # the view the dashboard opens with
                         inline=True,  # Display options side by side
                         labelStyle={
                             "font-size": "0.8rem",    # Match checkbox text size
@@ -417,13 +453,105 @@ def get_annotators(df_):
     annotators = df_['annotator'].dropna().unique().tolist()
     return ["All"] + annotators
 
-def get_app_layout(graph_data, color_legends=None, directed=False, vis_opts=None):
+def get_cube_layout(cube):
+    """Create the agreement cube page: heatmap filters on the left, the heatmap on the right
+
+    Parameters
+    --------------
+    cube: AgreementCube
+        precomputed agreement counts the heatmap is sliced from
+    """
+    dimension_options = [{"label": dimension.replace("_", " ").capitalize(), "value": dimension} for dimension in CUBE_DIMENSIONS]
+    filter_style = {"width": "96%", "margin-top": "10px", "margin-left": "auto", "margin-right": "auto", "display": "block", "font-size": "0.8rem"}
+    return dbc.Row(
+        [
+            dbc.Col(
+                dbc.Form(
+                    [
+                        html.Div(html.A("Back to the graph", href="/"), style=filter_style),
+                        html.Div(get_select_form_layout("cube_index", dimension_options, "Rows", "Heatmap rows", value="relation"), style=filter_style),
+                        html.Div(get_select_form_layout("cube_columns", dimension_options, "Columns", "Heatmap columns", value="annotator_pair"), style=filter_style),
+                        html.Div(
+                            get_select_form_layout("cube_metric", [{"label": metric, "value": metric} for metric in CUBE_METRICS], "Metric", "Value of each cell", value="f1"),
+                            style=filter_style,
+                        ),
+                        html.Div(
+                            dbc.RadioItems(
+                                id="cube_granularity",
+                                options=[
+                                    {"label": "Span", "value": "span"},
+                                    {"label": "+Nuclearity", "value": "nuclearity"},
+                                    {"label": "Full", "value": "full"}
+                                ],
+                                value="full",
+                                inline=True,
+                                labelStyle={"font-size": "0.8rem", "margin-right": "5px"},
+                            ),
+                            style=filter_style,
+                        ),
+                        html.Div(
+                            [
+                                dbc.Input(id="cube_documents", placeholder="Documents containing...", debounce=True, bs_size="sm"),
+                                dbc.FormText("Filter documents by name", color="secondary"),
+                            ],
+                            style=filter_style,
+                        ),
+                        html.Div(
+                            dcc.Dropdown(
+                                id="cube_relations",
+                                options=[{"label": relation, "value": relation} for relation in cube.categories("relation")],
+                                multi=True,
+                                placeholder="All relations",
+                            ),
+                            style=filter_style,
+                        ),
+                        html.Div(
+                            dcc.Dropdown(
+                                id="cube_pairs",
+                                options=[{"label": pair, "value": pair} for pair in cube.categories("annotator_pair")],
+                                multi=True,
+                                placeholder="All annotator pairs",
+                            ),
+                            style=filter_style,
+                        ),
+                    ],
+                    style={
+                        "width": "240px",
+                        "position": "fixed",
+                        "top": "30px",
+                        "left": "30px",
+                        "z-index": "800",
+                        "background": "#e5e5e5",
+                        "border-radius": "10px",
+                        "border": "1px solid #ccc",
+                        "padding-bottom": "10px",
+                    },
+                ),
+                width=2,
+            ),
+            dbc.Col(
+                dcc.Graph(id="cube_heatmap", style={"height": "95vh"}),
+                width=10,
+            ),
+        ],
+        no_gutters=True,
+        style={"height": "100vh", "padding": "0", "margin": "0"},
+    )
+
+
+def get_app_layout(graph_data, color_legends=None, directed=False, vis_opts=None, cube=None, session_id=None):
     """Create and return the layout of the app
 
     Parameters
     --------------
     graph_data: dict{nodes, edges}
         network data in format of visdcc
+
+    cube: AgreementCube (optional)
+        adds the agreement cube page at '/cube', see `get_cube_layout`
+
+    session_id: str (optional)
+        id of the server-side graph state of this page, see `GraphSessions`
     """
     # Get numerical features of nodes and edges
     if color_legends is None:
@@ -454,80 +582,91 @@ def get_app_layout(graph_data, color_legends=None, directed=False, vis_opts=None
                     },
                 ),
             ),
-            # settings panel
-            dbc.Row(
-                [
-                    dbc.Col(
-                        dbc.Form(
-                            [
-                                # ---- search section ----
-                                # search_form,
-                                # ---- annotators section ----
-                                html.Div(
-                                    # TODO decrease font 
-                                    get_select_form_layout(
-                                        id="annotator",
-                                        options=[{"label": annotator, "value": annotator} for annotator in annotators],
-                                        label="Annotator",
-                                        description="Select annotator"
+            dcc.Location(id="url"),
+            dcc.Store(id="session_id", data=session_id),
+            # graph page
+            html.Div(
+                # settings panel
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            dbc.Form(
+                                [
+                                    # ---- search section ----
+                                    search_form,
+                                    # ---- annotators section ----
+                                    html.Div(
+                                        # TODO decrease font 
+                                        get_select_form_layout(
+                                            id="annotator",
+                                            options=[{"label": annotator, "value": annotator} for annotator in annotators],
+                                            label="Annotator",
+                                            description="Select annotator",
+                                            value="All",
+                                        ),
+                                        style={
+                                            "width": "96%", 
+                                            "margin-top": "10px",
+                                            "margin-left": "auto",
+                                            "margin-right": "auto",
+                                            "display": "block",
+                                            "font-size": "0.8rem", 
+                                        }
                                     ),
-                                    style={
-                                        "width": "96%", 
-                                        "margin-top": "10px",
-                                        "margin-left": "auto",
-                                        "margin-right": "auto",
-                                        "display": "block",
-                                        "font-size": "0.8rem", 
-                                    }
-                                ),
-                                # ---- checkbox section ----
-                                common_nodes_form,
-                                toggle_view_form,
-                                # slider_view_form,
-                            ],
+                                    # ---- checkbox section ----
+                                    common_nodes_form,
+                                    toggle_view_form,
+                                    # slider_view_form,
+                                    # ---- pages section ----
+                                    *([html.Div(html.A("Agreement cube", href="/cube"), style={"margin": "10px", "font-size": "0.8rem"})] if cube is not None else []),
+                                ],
+                                style={
+                                    "width": "200px",
+                                    "height": "500",
+                                    "position": "fixed",
+                                    "top": "30px",
+                                    "left": "30px",
+                                    "z-index": "800",
+                                    "background": "#e5e5e5",
+                                    "border-radius": "10px",
+                                    "border": "1px solid #ccc",
+                                },
+                            ),
+                            width=1,  # Settings take up 3/12 of the row
                             style={
-                                "width": "200px",
-                                "height": "500",
-                                "position": "fixed",
-                                "top": "30px",
-                                "left": "30px",
-                                "z-index": "800",
-                                "background": "#e5e5e5",
-                                "border-radius": "10px",
-                                "border": "1px solid #ccc",
+                                "overflow-y": "auto", 
+                                "height": "100%",
                             },
                         ),
-                        width=1,  # Settings take up 3/12 of the row
-                        style={
-                            "overflow-y": "auto", 
-                            "height": "100%",
-                        },
-                    ),
-                    dbc.Col(
-                        visdcc.Network(  # type: ignore[attr-defined]
-                            id="graph",
-                            data=graph_data,
-                            options=get_options(directed, vis_opts),
+                        dbc.Col(
+                            visdcc.Network(  # type: ignore[attr-defined]
+                                id="graph",
+                                data=graph_data,
+                                options=get_options(directed, vis_opts),
+                                style={
+                                    "width": "100%",
+                                    "height": "100%",
+                                },
+                            ),
+                            width=9,
                             style={
                                 "width": "100%",
-                                "height": "100%",
+                                "height": "100%",  # Ensure the column also spans full height
+                                "padding": "0",     # Remove padding if necessary
+                                "margin": "0",
                             },
                         ),
-                        width=9,
-                        style={
-                            "width": "100%",
-                            "height": "100%",  # Ensure the column also spans full height
-                            "padding": "0",     # Remove padding if necessary
-                            "margin": "0",
-                        },
-                    ),
-                ],
-                no_gutters=True,
-                style={
-                    "height": "100vh",      # Set the row to full viewport height
-                    "padding": "0",
-                    "margin": "0",
-                },
+                    ],
+                    no_gutters=True,
+                    style={
+                        "height": "100vh",      # Set the row to full viewport height
+                        "padding": "0",
+                        "margin": "0",
+                    },
+                ),
+                id="graph_page",
             ),
+            # agreement cube page, shown at '/cube'
+            *([html.Div(get_cube_layout(cube), id="cube_page", style={"display": "none"})] if cube is not None else []),
         ]
     )
\ No newline at end of file
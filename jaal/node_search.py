@@ -0,0 +1,117 @@
+"""
+Search index over the labels and EDU texts of the graph nodes
+
+Every distinct text is split into n-grams once, and the inverted index maps each n-gram to the sorted ids of the
+texts containing it. A query only reads the posting lists of its own n-grams, instead of scanning every label.
+"""
+
+import math
+
+import numpy as np
+
+# node properties whose text is searched, EDU leaves carry their text in the label
+SEARCH_FIELDS = ("label", "edus")
+# length of the n-grams of the index
+GRAM_LENGTH = 3
+# share of a query's n-grams a text must contain to match it approximately
+DEFAULT_FUZZY_SIMILARITY = 0.7
+# queries shorter than this only match exactly, approximate matches of a few letters are noise
+MIN_FUZZY_LENGTH = 4
+# bits of a character in an n-gram code, enough for every unicode code point
+_CHARACTER_BITS = 21
+
+
+def normalize_text(text):
+    """Lowercase text with single spaces, the form texts and queries are compared in."""
+    return " ".join(str(text).lower().split())
+
+
+def _codepoints(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+
+def _gram_codes(codepoints):
+    """The code of every n-gram of a code point array, one character per `_CHARACTER_BITS`."""
+    return (codepoints[:-2] << 2 * _CHARACTER_BITS) | (codepoints[1:-1] << _CHARACTER_BITS) | codepoints[2:]
+
+
+class NodeSearchIndex:
+    """N-gram inverted index of the texts of graph nodes, with prefix and approximate matching.
+
+    Texts are indexed with a space on each side, so the n-grams starting with a space are word prefixes. A query
+    of one or two characters matches the nodes with a word starting with it, longer queries match the texts
+    containing them, and from `MIN_FUZZY_LENGTH` characters on also the texts containing `fuzzy_similarity` of
+    their n-grams, which tolerates a typo or two.
+    """
+    def __init__(self, nodes, fields=SEARCH_FIELDS, fuzzy_similarity=DEFAULT_FUZZY_SIMILARITY):
+        """
+        Parameters
+        -------------
+        nodes: list of dict
+            the nodes of a graph, in format of visdcc
+
+        fields: tuple of str (optional)
+            node properties whose text is searched, non-string values are skipped
+
+        fuzzy_similarity: float (optional)
+            share of a query's n-grams a text must contain to match approximately, 1 disables approximate matches
+        """
+        self.fuzzy_similarity = fuzzy_similarity
+        texts = [normalize_text(" ".join(node[field] for field in fields if isinstance(node.get(field), str))) for node in nodes]
+        # relation labels repeat on every tree, each distinct text is indexed once
+        distinct, self._text_ids = np.unique(np.array(texts, dtype=object), return_inverse=True)
+        self._padded = [f" {text} " for text in distinct.tolist()]
+
+        # all texts in one array, separated by a zero no n-gram may contain
+        codepoints = _codepoints("\0".join(self._padded))
+        owners = np.repeat(np.arange(len(self._padded), dtype=np.int32), [len(text) + 1 for text in self._padded])[:len(codepoints)]
+        valid = (codepoints[:-2] != 0) & (codepoints[1:-1] != 0) & (codepoints[2:] != 0)
+        grams, owners = _gram_codes(codepoints)[valid], owners[:-2][valid]
+
+        # posting lists, a stable sort keeps the text ids of an n-gram ascending
+        order = np.argsort(grams, kind="stable")
+        grams, owners = grams[order], owners[order]
+        first = np.ones(len(grams), dtype=bool)
+        first[1:] = (grams[1:] != grams[:-1]) | (owners[1:] != owners[:-1])
+        grams, self._postings = grams[first], owners[first]
+        self._grams, starts = np.unique(grams, return_index=True)
+        self._offsets = np.append(starts, len(grams))
+
+    def __len__(self):
+        return len(self._text_ids)
+
+    def search(self, query, fuzzy=True):
+        """The rows of the nodes matching `query`, in node order."""
+        return np.flatnonzero(self.mask(query, fuzzy))
+
+    def mask(self, query, fuzzy=True):
+        """Whether every node matches `query`, see the class description for what matches."""
+        return self._matching_texts(normalize_text(query), fuzzy)[self._text_ids]
+
+    def _matching_texts(self, query, fuzzy):
+        matched = np.zeros(len(self._padded), dtype=bool)
+        if not query:
+            return matched
+        pattern = f" {query}" if len(query) < GRAM_LENGTH else query
+        codepoints = _codepoints(pattern)
+
+        # a single letter: every n-gram starting with a space and the letter, a contiguous range of the index
+        if len(pattern) < GRAM_LENGTH:
+            first_code = (codepoints[0] << 2 * _CHARACTER_BITS) | (codepoints[1] << _CHARACTER_BITS)
+            start, stop = np.searchsorted(self._grams, [first_code, first_code + (1 << _CHARACTER_BITS)])
+            matched[self._postings[self._offsets[start]:self._offsets[stop]]] = True
+            return matched
+
+        grams = np.unique(_gram_codes(codepoints))
+        positions = np.searchsorted(self._grams, grams)
+        counts = np.zeros(len(self._padded), dtype=np.int32)
+        for position, gram in zip(positions.tolist(), grams.tolist()):
+            if position < len(self._grams) and self._grams[position] == gram:
+                counts[self._postings[self._offsets[position]:self._offsets[position + 1]]] += 1
+
+        if fuzzy and len(query) >= MIN_FUZZY_LENGTH:
+            return counts >= max(1, math.ceil(self.fuzzy_similarity * len(grams)))
+        # texts with every n-gram of the query may still have them in another order
+        for text in np.flatnonzero(counts == len(grams)).tolist():
+            matched[text] = pattern in self._padded[text]
+        return matched
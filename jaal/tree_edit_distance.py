@@ -0,0 +1,266 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# edit operation of every aligned node, see `TreeEditDistance.align`
+EDIT_OPERATIONS = ['match', 'rename', 'delete', 'insert']
+
+
+def _compiled(function):
+    """Compiles `function` with Numba if it is installed, it runs as plain Python (much slower) otherwise."""
+    return numba.njit(nogil=True)(function) if numba is not None else function
+
+
+@dataclass(slots=True)
+class OrderedTree():
+    """An annotator's tree in postorder, as the compact arrays the edit distance works on."""
+    # row of every node in the node dataframe, in postorder
+    rows: np.ndarray
+    # postorder index of the leftmost leaf below every node
+    leftmost: np.ndarray
+    # integer label of every node, nodes with equal labels are renamed for free
+    labels: np.ndarray
+    # nodes that are no leftmost child, in increasing order
+    keyroots: np.ndarray
+
+    @classmethod
+    def from_children(cls, rows: np.ndarray, children: dict[int, list[int]], root: int, labels: np.ndarray, mirrored: bool =False) -> 'OrderedTree':
+        """Numbers the nodes below `root` in postorder, `children` lists the ordered children of each row.
+
+        A `mirrored` tree takes the children from right to left, its leftmost paths are the rightmost paths of the tree.
+        """
+        order: list[int] = []
+        leftmost: list[int] = []
+        stack = [(root, False)]
+        first_leaf: dict[int, int] = {}
+        while stack:
+            row, visited = stack.pop()
+            row_children = children.get(row, [])
+            if mirrored:
+                row_children = row_children[::-1]
+            if visited or not row_children:
+                first_leaf[row] = first_leaf[row_children[0]] if row_children else len(order)
+                leftmost.append(first_leaf[row])
+                order.append(row)
+                continue
+            stack.append((row, True))
+            stack.extend((child, False) for child in reversed(row_children))
+
+        leftmost = np.array(leftmost, dtype=np.int64)
+        # the last (highest) node of every leftmost leaf is a keyroot
+        keyroots = np.array(sorted({leaf: node for node, leaf in enumerate(leftmost.tolist())}.values()), dtype=np.int64)
+        order = np.array(order, dtype=np.int64)
+        return cls(rows[order], leftmost, labels[order], keyroots)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def subproblems(self) -> int:
+        """Number of forests the keyroots decompose the tree into, the edit distance takes time in their product."""
+        return int((self.keyroots - self.leftmost[self.keyroots] + 1).sum())
+
+
+class TreeEditDistance:
+    """Ordered tree edit distance and optimal node alignment between the trees of two annotators.
+
+    Implements the Zhang-Shasha algorithm with unit costs: deleting or inserting a node costs 1, renaming it costs 1
+    unless both nodes have the same label ('relation' and 'nuclearity' for inner nodes, the EDU span for leaves).
+    The tree distances of all subproblems are memoized in one int32 matrix, the forest distances of every pair of
+    keyroots are filled by a loop compiled with Numba (each cell depends on its left neighbour, which leaves little
+    for NumPy to vectorize). Without Numba installed the same loop runs as plain Python, which is correct but orders
+    of magnitude slower. The trees are decomposed along their leftmost or their rightmost paths, whichever gives
+    fewer subproblems.
+    """
+    def __init__(self, max_workers: int | None =1):
+        """
+        Parameters
+        -------------
+        max_workers: int (optional)
+            number of processes `align_many` spreads the document pairs over, `None` uses every available core
+            (default: 1, i.e. compute in the calling process)
+        """
+        self.max_workers = max_workers
+
+    def align(self, node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame, annotator_a: str, annotator_b: str) -> pd.DataFrame:
+        """
+        Aligns the trees of two annotators in one document, as built by `TreeBuilder.build` (shared EDU leaves
+        included). Returns a copy of the node dataframe with the additional columns 'aligned_id', the id of the node
+        of the other annotator each node is mapped to, and 'edit_operation', one of `EDIT_OPERATIONS` ('delete' for
+        unmapped nodes of `annotator_a`, 'insert' for those of `annotator_b`). Rows of other annotators keep `None`.
+        The distance is stored in `attrs["tree_edit_distance"]`.
+        """
+        tree_a, tree_b = self.trees(node_dataframe, edge_dataframe, annotator_a, annotator_b)
+        distance, mapping = _zhang_shasha(tree_a, tree_b)
+
+        result_dataframe = node_dataframe.copy()
+        ids = result_dataframe["id"].astype(str).to_numpy()
+        aligned_id = np.full(len(result_dataframe), None, dtype=object)
+        edit_operation = np.full(len(result_dataframe), None, dtype=object)
+        edit_operation[tree_a.rows] = 'delete'
+        edit_operation[tree_b.rows] = 'insert'
+
+        rows_a, rows_b = tree_a.rows[mapping[:, 0]], tree_b.rows[mapping[:, 1]]
+        renamed = tree_a.labels[mapping[:, 0]] != tree_b.labels[mapping[:, 1]]
+        aligned_id[rows_a], aligned_id[rows_b] = ids[rows_b], ids[rows_a]
+        edit_operation[rows_a] = edit_operation[rows_b] = np.where(renamed, 'rename', 'match')
+
+        result_dataframe["aligned_id"] = aligned_id
+        result_dataframe["edit_operation"] = edit_operation
+        result_dataframe.attrs["tree_edit_distance"] = distance
+        return result_dataframe
+
+    def distance(self, node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame, annotator_a: str, annotator_b: str) -> int:
+        """The edit distance between the trees of two annotators, without the alignment."""
+        tree_a, tree_b = self.trees(node_dataframe, edge_dataframe, annotator_a, annotator_b)
+        return int(_tree_distances(tree_a, tree_b)[-1, -1])
+
+    def align_many(self, documents: list[tuple[pd.DataFrame, pd.DataFrame, str, str]]) -> list[pd.DataFrame]:
+        """Aligns many `(node_dataframe, edge_dataframe, annotator_a, annotator_b)` pairs, spread over processes."""
+        if self.max_workers == 1 or len(documents) < 2:
+            return [self.align(*document) for document in documents]
+
+        workers = self.max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(documents) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.align, *zip(*documents), chunksize=chunksize))
+
+    @staticmethod
+    def trees(node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame, annotator_a: str, annotator_b: str) -> tuple[OrderedTree, OrderedTree]:
+        """The ordered trees of both annotators, children ordered by their EDU span and then their edge order.
+
+        Both trees are mirrored when their rightmost paths decompose them into fewer subproblems than their
+        leftmost paths, the distance and the mapping are the same either way.
+        """
+        ids = node_dataframe["id"].astype(str).to_numpy()
+        annotators = node_dataframe["annotator"].astype(object).to_numpy()
+        is_leaf = node_dataframe["is_leaf"].to_numpy()
+        span_columns = ["first_token", "last_token"] if "first_token" in node_dataframe.columns else ["first_edu", "last_edu"]
+        first = node_dataframe[span_columns[0]].to_numpy()
+
+        # inner nodes are labelled by relation and nuclearity, leaves by their span
+        inner_labels = node_dataframe["relation"].astype(str) + "|" + node_dataframe["nuclearity"].astype(str)
+        leaf_labels = "edu|" + node_dataframe[span_columns[0]].astype(str) + "|" + node_dataframe[span_columns[1]].astype(str)
+        labels = pd.factorize(np.where(is_leaf, leaf_labels, inner_labels))[0].astype(np.int64)
+
+        # shared EDU leaves may occur several times, their first row is used
+        row_of: dict[str, int] = {}
+        for row, node_id in enumerate(ids.tolist()):
+            row_of.setdefault(node_id, row)
+
+        trees = {False: [], True: []}
+        for annotator in (annotator_a, annotator_b):
+            children: dict[int, list[int]] = {}
+            has_parent: set[int] = set()
+            for child_id, parent_id in zip(edge_dataframe["from"].astype(str).tolist(), edge_dataframe["to"].astype(str).tolist()):
+                child, parent = row_of.get(child_id), row_of.get(parent_id)
+                if child is None or parent is None or annotators[parent] != annotator:
+                    continue
+                children.setdefault(parent, []).append(child)
+                has_parent.add(child)
+            for row_children in children.values():
+                row_children.sort(key=lambda child: first[child])
+
+            roots = [row for row in np.flatnonzero(annotators == annotator).tolist() if row not in has_parent]
+            if len(roots) != 1:
+                raise ValueError(f"Expected a single root in the tree of annotator '{annotator}', found {len(roots)}")
+            for mirrored, oriented_trees in trees.items():
+                oriented_trees.append(OrderedTree.from_children(np.arange(len(ids)), children, roots[0], labels, mirrored))
+
+        tree_a, tree_b = min(trees.values(), key=lambda oriented_trees: oriented_trees[0].subproblems * oriented_trees[1].subproblems)
+        return tree_a, tree_b
+
+
+def _tree_distances(tree_a: OrderedTree, tree_b: OrderedTree) -> np.ndarray:
+    """The edit distance between every subtree of `tree_a` and every subtree of `tree_b`, in postorder."""
+    tree_distances = np.zeros((len(tree_a), len(tree_b)), dtype=np.int32)
+    forest = np.empty((len(tree_a) + 1, len(tree_b) + 1), dtype=np.int32)
+    _keyroot_distances(tree_a.leftmost, tree_a.labels, tree_a.keyroots, tree_b.leftmost, tree_b.labels, tree_b.keyroots, tree_distances, forest)
+    return tree_distances
+
+
+def _forest_distances(tree_a: OrderedTree, tree_b: OrderedTree, tree_distances: np.ndarray, root_a: int, root_b: int) -> np.ndarray:
+    """The forest distances below one pair of nodes, from the memoized tree distances."""
+    forest = np.empty((root_a - tree_a.leftmost[root_a] + 2, root_b - tree_b.leftmost[root_b] + 2), dtype=np.int32)
+    _fill_forest(tree_a.leftmost, tree_a.labels, tree_b.leftmost, tree_b.labels, tree_distances, forest, root_a, root_b)
+    return forest
+
+
+@_compiled
+def _keyroot_distances(leftmost_a, labels_a, keyroots_a, leftmost_b, labels_b, keyroots_b, tree_distances, forest):
+    """Fills the forest distances of every pair of keyroots, in increasing order, into one reused `forest` table."""
+    for root_a in keyroots_a:
+        for root_b in keyroots_b:
+            _fill_forest(leftmost_a, labels_a, leftmost_b, labels_b, tree_distances, forest, root_a, root_b)
+
+
+@_compiled
+def _fill_forest(leftmost_a, labels_a, leftmost_b, labels_b, tree_distances, forest, root_a, root_b):
+    """Fills `forest[x, y]`, the distance between the forests of the first x nodes below `root_a` and the first y
+    nodes below `root_b` in postorder.
+
+    Where both nodes are on the leftmost path of their root the forests end in the two nodes as whole trees, those
+    cells complete the tree distances of the pair. Elsewhere the tree distances of smaller keyroots are read.
+    """
+    first_a, first_b = leftmost_a[root_a], leftmost_b[root_b]
+    # node first_b + y of tree b is column y + 1, slices indexed by y spare the checks for negative indices
+    left_columns = leftmost_b[first_b:root_b + 1] - first_b
+    labels = labels_b[first_b:root_b + 1]
+    forest[0, :root_b - first_b + 2] = np.arange(root_b - first_b + 2)
+    for x in range(1, root_a - first_a + 2):
+        node_a = first_a + x - 1
+        previous, current, left = forest[x - 1], forest[x], forest[leftmost_a[node_a] - first_a]
+        row_distances = tree_distances[node_a, first_b:root_b + 1]
+        best = current[0] = x
+        if leftmost_a[node_a] == first_a:
+            for y in range(len(labels)):
+                if left_columns[y] == 0:
+                    best = min(previous[y + 1] + 1, best + 1, previous[y] + (labels_a[node_a] != labels[y]))
+                    row_distances[y] = best
+                else:
+                    best = min(previous[y + 1] + 1, best + 1, left[left_columns[y]] + row_distances[y])
+                current[y + 1] = best
+        else:
+            for y in range(len(labels)):
+                best = min(previous[y + 1] + 1, best + 1, left[left_columns[y]] + row_distances[y])
+                current[y + 1] = best
+
+
+def _zhang_shasha(tree_a: OrderedTree, tree_b: OrderedTree) -> tuple[int, np.ndarray]:
+    """The edit distance and the `(node_a, node_b)` postorder pairs of an optimal mapping."""
+    if not len(tree_a) or not len(tree_b):
+        return len(tree_a) + len(tree_b), np.empty((0, 2), dtype=np.int64)
+    tree_distances = _tree_distances(tree_a, tree_b)
+
+    mapping = []
+    subproblems = [(len(tree_a) - 1, len(tree_b) - 1)]
+    while subproblems:
+        root_a, root_b = subproblems.pop()
+        leftmost_a, leftmost_b = int(tree_a.leftmost[root_a]), int(tree_b.leftmost[root_b])
+        forest = _forest_distances(tree_a, tree_b, tree_distances, root_a, root_b)
+        x, y = forest.shape[0] - 1, forest.shape[1] - 1
+        while x > 0 and y > 0:
+            node_a, node_b = leftmost_a + x - 1, leftmost_b + y - 1
+            node_leftmost_a, node_leftmost_b = int(tree_a.leftmost[node_a]), int(tree_b.leftmost[node_b])
+            if node_leftmost_a == leftmost_a and node_leftmost_b == leftmost_b:
+                if forest[x, y] == forest[x - 1, y - 1] + (tree_a.labels[node_a] != tree_b.labels[node_b]):
+                    mapping.append((node_a, node_b))
+                    x, y = x - 1, y - 1
+                    continue
+            elif forest[x, y] == forest[node_leftmost_a - leftmost_a, node_leftmost_b - leftmost_b] + tree_distances[node_a, node_b]:
+                # the two subtrees are aligned with each other, as a subproblem of their own
+                subproblems.append((node_a, node_b))
+                x, y = node_leftmost_a - leftmost_a, node_leftmost_b - leftmost_b
+                continue
+            if forest[x, y] == forest[x - 1, y] + 1:
+                x -= 1
+            else:
+                y -= 1
+    return int(tree_distances[-1, -1]), np.array(sorted(mapping), dtype=np.int64).reshape(-1, 2)
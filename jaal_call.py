@@ -4,6 +4,7 @@ import pandas as pd
 from jaal.jaal import Jaal
 from jaal.jaal.annotator_agreement import AnnotatorAgreement
 from jaal.jaal.datasets import load_got
+from jaal.rs3_cache import RS3Cache
 from jaal.rs3_parser_ import RS3Parser
 
 def main():
@@ -15,13 +16,18 @@ def main():
         # 'annotator_2': Path('/Users/pg/Documents/thesis/rs3_parser/Corpus_Clean/demo2_1-21-2-18-a2.rs3')
     }
 
-    rs3_parser = RS3Parser()
-    node_df, edge_df = rs3_parser.parse_files(annotations)
+    rs3_parser = RS3Parser(cache=RS3Cache())
+    views = rs3_parser.parse_files_views(annotations)
     # print("Main: ", node_df.columns)
     # print("Done")
     # exit()
 
-    node_df = AnnotatorAgreement().find_agreements(node_df)
+    annotator_agreement = AnnotatorAgreement()
+    views = {
+        view: {'edges': edge_df, 'nodes': annotator_agreement.find_subtree_agreements(annotator_agreement.find_agreements(node_df), edge_df)}
+        for view, (node_df, edge_df) in views.items()
+    }
+    edge_df, node_df = views[rs3_parser.view]['edges'], views[rs3_parser.view]['nodes']
     # TODO check result for badly assigned node edus, or whatever the issue with wrong agreement highlight is
     # print(node_df)
 
@@ -55,7 +61,7 @@ def main():
                 # 'physics':{'stabilization':{'iterations': 100}}} # define the convergence iteration of network
 
     # init Jaal and run server (with opts)
-    Jaal(edge_df, node_df).plot(directed=True, vis_opts=vis_opts)
+    Jaal(edge_df, node_df, views=views).plot(directed=True, vis_opts=vis_opts)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
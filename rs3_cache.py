@@ -0,0 +1,116 @@
+import hashlib
+import os
+from pathlib import Path
+import pandas as pd
+
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'jaal' / 'rs3'
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+_NODES_SUFFIX = '.nodes.parquet'
+_EDGES_SUFFIX = '.edges.parquet'
+
+
+class RS3Cache():
+    """On-disk cache of the node and edge frames built from `.rs3` files.
+
+    Entries are stored as Parquet files named after the content hash of the source file followed by a digest of
+    the annotator, the parser version and the builder type, so an edited file never hits a stale entry and a whole
+    file can be invalidated by its content hash alone. Least recently used entries are evicted once the cache grows
+    beyond `max_bytes`.
+    """
+    def __init__(self, directory: Path | str =DEFAULT_CACHE_DIR, max_bytes: int =DEFAULT_MAX_BYTES):
+        """
+        Parameters
+        -------------
+        directory: Path
+            directory holding the cached frames, created if missing (default: ~/.cache/jaal/rs3)
+
+        max_bytes: int
+            size cap of the cache directory, the least recently used entries are removed above it (default: 1 GiB)
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, file, annotator: str, parser_version: str, builder: str, file_hash: str | None =None) -> str:
+        """Returns the cache key of the frames built from `file` for the given annotator, parser version and builder.
+
+        `file_hash` is the `content_hash` of `file` if already known, the keys of several builders of one file then
+        do not read it again.
+        """
+        settings = '\0'.join([annotator, parser_version, builder]).encode()
+        file_hash = self.content_hash(file) if file_hash is None else file_hash
+        return f'{file_hash}-{hashlib.blake2b(settings, digest_size=8).hexdigest()}'
+
+    def load(self, key: str) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+        """Returns the cached `(nodes, edges)` frames stored under `key`, or None on a cache miss."""
+        nodes_path, edges_path = self._entry_paths(key)
+        try:
+            nodes = pd.read_parquet(nodes_path)
+            edges = pd.read_parquet(edges_path)
+        except FileNotFoundError:
+            return None
+
+        # mark the entry as recently used for the eviction order
+        os.utime(nodes_path)
+        os.utime(edges_path)
+
+        # Parquet hands list columns back as arrays
+        if 'edus' in nodes.columns:
+            nodes['edus'] = [edus.tolist() if edus is not None else None for edus in nodes['edus']]
+        return nodes, edges
+
+    def store(self, key: str, nodes: pd.DataFrame, edges: pd.DataFrame) -> None:
+        """Writes the frames under `key` and evicts old entries if the size cap is exceeded."""
+        for frame, path in zip((nodes, edges), self._entry_paths(key)):
+            # write next to the target and rename, so parallel parsers never read half written files
+            partial_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            frame.to_parquet(partial_path, index=False)
+            os.replace(partial_path, path)
+        self.evict()
+
+    def invalidate(self, file=None) -> int:
+        """Removes every entry built from the current content of `file`, or the whole cache if no file is given.
+
+        Returns the number of removed files.
+        """
+        pattern = f'{self.content_hash(file)}-*' if file is not None else '*'
+        removed = 0
+        for path in self.directory.glob(pattern):
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits into `max_bytes`."""
+        entries = []
+        total_size = 0
+        for nodes_path in self.directory.glob(f'*{_NODES_SUFFIX}'):
+            edges_path = nodes_path.with_name(nodes_path.name.replace(_NODES_SUFFIX, _EDGES_SUFFIX))
+            try:
+                nodes_stat = nodes_path.stat()
+                size = nodes_stat.st_size + (edges_path.stat().st_size if edges_path.exists() else 0)
+            except FileNotFoundError:
+                continue  # removed by another process meanwhile
+            entries.append((nodes_stat.st_mtime, size, nodes_path, edges_path))
+            total_size += size
+
+        for _, size, nodes_path, edges_path in sorted(entries, key=lambda entry: entry[0]):
+            if total_size <= self.max_bytes:
+                break
+            nodes_path.unlink(missing_ok=True)
+            edges_path.unlink(missing_ok=True)
+            total_size -= size
+
+    def size(self) -> int:
+        """Returns the size of all cached entries in bytes."""
+        return sum(path.stat().st_size for path in self.directory.glob('*.parquet'))
+
+    @staticmethod
+    def content_hash(file) -> str:
+        """Hashes the bytes of `file`."""
+        with open(file, 'rb') as fp:
+            return hashlib.file_digest(fp, 'blake2b').hexdigest()[:32]
+
+    def _entry_paths(self, key: str) -> tuple[Path, Path]:
+        return self.directory / f'{key}{_NODES_SUFFIX}', self.directory / f'{key}{_EDGES_SUFFIX}'
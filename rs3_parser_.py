@@ -1,47 +1,192 @@
 from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import repeat
 from operator import concat
+import os
+import sys
 from pathlib import Path
+from typing import Iterator
 from xml.dom import NotFoundErr
 import xml.etree.ElementTree as ET
 import pandas as pd
+from pandas.api.types import union_categoricals
 
+from jaal.rs3_cache import RS3Cache
+from jaal.segment_alignment import align_segments
 from jaal.tree_builder.constituent_tree_builder import ConstituentTreeBuilder
 from jaal.tree_builder.rs3_tree_builder import RS3TreeBuilder
-from jaal.tree_builder.tree_builder import Edge, RelationNode
+from jaal.tree_builder.topology import TreeTopology
+from jaal.tree_builder.tree_builder import CATEGORICAL_NODE_COLUMNS, Edge, EduLayer, RelationNode
 from jaal.tree_builder.tree_builder import TreeBuilder
 
+# bump whenever a change to the parser or the builders alters the frames, it invalidates cached entries
+PARSER_VERSION = '5'
+
+# tree views built from every parsed file, by name
+VIEW_BUILDERS: dict[str, type[TreeBuilder]] = {
+    'constituent': ConstituentTreeBuilder,
+    'rst': RS3TreeBuilder,
+}
+DEFAULT_VIEW = 'constituent'
+
 
 class RS3Parser():
-    def __init__(self):
-        pass
+    def __init__(self, streaming: bool =False, max_workers: int | None =1, cache: RS3Cache | None =None, share_edus: bool =False, view: str =DEFAULT_VIEW, align_segments: bool =False):
+        """
+        Parameters
+        -------------
+        streaming: bool
+            read the XML incrementally with `iterparse`, releasing every <body> element once it has been
+            turned into a node and an edge, instead of loading the whole document tree first (default: False)
+
+        max_workers: int (optional)
+            number of processes used by `parse_files` to parse and build the files in parallel,
+            `None` uses every available core (default: 1, i.e. parse in the calling process)
+
+        cache: RS3Cache (optional)
+            on-disk cache the built frames are loaded from instead of parsing and building unchanged files again
+            (default: None)
+
+        share_edus: bool
+            build the EDU leaf nodes once per document and share them between the annotators' trees, instead of
+            giving every annotator its own copy of each leaf (default: False)
+
+        view: str
+            name of the tree view in `VIEW_BUILDERS` returned by `parse`, `parse_files` and `parse_corpus`
+            (default: 'constituent')
+
+        align_segments: bool
+            add the spans in token offsets shared by all annotators of a document to the node frames, so annotators
+            that segmented the text differently can still agree on spans, see `align_segments` (default: False)
+        """
+        if view not in VIEW_BUILDERS:
+            raise ValueError(f"Unknown view '{view}', expected one of {list(VIEW_BUILDERS)}")
+        self.streaming = streaming
+        self.max_workers = max_workers
+        self.cache = cache
+        self.share_edus = share_edus
+        self.view = view
+        self.align_segments = align_segments
 
     def parse_files(self, files: dict[str,Path]):
-        nodes = pd.DataFrame()
-        edges = pd.DataFrame()
-        for annotator, file in files.items():
-            annotator_nodes, annotator_edges = self.parse(file, annotator)
-            nodes = pd.concat([nodes, annotator_nodes], ignore_index=True)
-            edges = pd.concat([edges, annotator_edges], ignore_index=True)
+        return self.parse_files_views(files, views=[self.view])[self.view]
 
-        return nodes, edges
-        
-    def parse(self, file, annotator: str):
-        xml_tree = ET.parse(file)
-        relations = xml_tree.getroot().find("header/relations")
-        body = xml_tree.getroot().find("body")
+    def parse_files_views(self, files: dict[str,Path], views: list[str] | None =None) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+        """Parses the files of all annotators once and returns the concatenated `(nodes, edges)` frames of every
+        requested view (all of `VIEW_BUILDERS` by default)."""
+        views = list(VIEW_BUILDERS) if views is None else views
+        annotators = list(files.keys())
+        paths = list(files.values())
 
-        if relations is None:
-            raise NotFoundErr("<relations> tag not found in the XML.")
-        if body is None:
-            raise NotFoundErr("<body> tag not found in the XML.")
+        if len(paths) > 1 and self.max_workers != 1:
+            workers = self._worker_count()
+            chunksize = max(1, len(paths) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                file_views = list(executor.map(self.parse_views, paths, annotators, repeat(None), repeat(views), chunksize=chunksize))
+        else:
+            file_views = self._parse_many(files, views)
+
+        return {view: self._concat_frames([frames[view] for frames in file_views]) for view in views}
+
+    def scan_corpus(self, directory) -> dict[str, dict[str, Path]]:
+        """Pairs the annotations of a `<directory>/<annotator>/<document>.rs3` corpus layout by document.
+
+        Returns a map from each document name to the `{annotator: Path}` files that annotate it, in the form taken
+        by `parse_files`. Documents missing for some annotators are kept with the annotations that exist.
+        """
+        documents: dict[str, dict[str, Path]] = {}
+        for file in sorted(Path(directory).glob('*/*.rs3')):
+            documents.setdefault(file.stem, {})[file.parent.name] = file
+        return dict(sorted(documents.items()))
+
+    def parse_corpus(self, directory) -> Iterator[tuple[str, pd.DataFrame, pd.DataFrame]]:
+        """Lazily parses a `<directory>/<annotator>/<document>.rs3` corpus one document at a time.
+
+        Yields `(document, nodes, edges)` for every document, with a 'document' column added to both frames. Only
+        the document being yielded is held in memory, plus up to `max_workers` documents parsed ahead of it when
+        parsing in parallel. The trees of all annotations of a document are built together, see `_parse_many`.
+        """
+        documents = self.scan_corpus(directory)
+
+        if self.max_workers == 1:
+            for document, files in documents.items():
+                yield self._with_document(document, *self.parse_files(files))
+            return
+
+        workers = self._worker_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending: deque = deque()
+            for document, files in documents.items():
+                pending.append((document, executor.submit(self._parse_document, files)))
+                if len(pending) > workers:
+                    yield self._collect_document(*pending.popleft())
+            while pending:
+                yield self._collect_document(*pending.popleft())
         
-        relation_type = {}
-        for relation in list(relations):
-            nuclearity = 'S' if relation.get('type') == 'rst' else 'N'
-            relation_type[relation.get('name')] = nuclearity
-        relation_type['span'] = 'N'
+    def parse(self, file, annotator: str, edu_layer: EduLayer | None =None):
+        """Parses and builds the tree of one annotator's file, returning the `(nodes, edges)` frames of `self.view`.
+
+        With `share_edus`, the EDU leaves come from `edu_layer` (a new layer if not given). Their rows are part of
+        the returned frames either way, `parse_files` keeps a single row per shared leaf.
+        """
+        return self.parse_views(file, annotator, edu_layer, views=[self.view])[self.view]
+
+    def parse_views(self, file, annotator: str, edu_layer: EduLayer | None =None, views: list[str] | None =None) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+        """Parses one annotator's file once and builds every requested view (all of `VIEW_BUILDERS` by default).
+
+        The file is read a single time, each view is then built from the same parsed nodes and edges. Views are cached
+        separately, so the file is only parsed if one of them misses the cache.
+        """
+        views = list(VIEW_BUILDERS) if views is None else views
+        return self._parse_many({annotator: file}, views, edu_layer)[0]
+
+    def _parse_many(self, files: dict[str,Path], views: list[str], edu_layer: EduLayer | None =None) -> list[dict[str, tuple[pd.DataFrame, pd.DataFrame]]]:
+        """Parses the files of several annotators and builds their views, returning the frames of every view per file.
+
+        Views missing from the cache are built together with `TreeBuilder.build_many`, which assigns the depth levels
+        of all their trees in one batched call.
+        """
+        if self.share_edus and edu_layer is None:
+            edu_layer = EduLayer()
+
+        file_frames = [{} for _ in files]
+        pending = []
+        for frames, (annotator, file) in zip(file_frames, files.items()):
+            keys = {}
+            if self.cache is not None:
+                # every view of the file is looked up under the same content hash
+                file_hash = self.cache.content_hash(file)
+                for view in views:
+                    builder = VIEW_BUILDERS[view].__name__ + ('+shared_edus' if self.share_edus else '')
+                    keys[view] = self.cache.key(file, annotator, PARSER_VERSION, builder, file_hash)
+                    cached = self.cache.load(keys[view])
+                    if cached is not None:
+                        frames[view] = cached
+
+            missing = [view for view in views if view not in frames]
+            if missing:
+                for view, tree_builder in self._parse(file, annotator, edu_layer, missing).items():
+                    pending.append((frames, view, keys.get(view), tree_builder))
+
+        built = TreeBuilder.build_many([tree_builder for *_, tree_builder in pending])
+        for (frames, view, key, _), (nodes_df, edges_df) in zip(pending, built):
+            if key is not None:
+                self.cache.store(key, nodes_df, edges_df)
+            frames[view] = nodes_df, edges_df
+        return [{view: frames[view] for view in views} for frames in file_frames]
+
+    def _parse_document(self, files: dict[str,Path]):
+        """Parses all annotations of a document and returns the concatenated frames of `self.view`."""
+        return self._concat_frames([frames[self.view] for frames in self._parse_many(files, [self.view])])
+
+    def _parse(self, file, annotator: str, edu_layer: EduLayer | None, views: list[str]) -> dict[str, TreeBuilder]:
+        """Reads one annotator's file and returns a builder per requested view, ready to be built."""
 
-        items = list(body)
+        relation_type: dict[str, str] = {}
+        if self.streaming:
+            items = self._iter_body_streaming(file, relation_type)
+        else:
+            items = self._iter_body(file, relation_type)
 
         def leaf():
             return item.tag == 'segment'
@@ -50,12 +195,15 @@ class RS3Parser():
         nodes: list[RelationNode] = []
         edges: list[Edge] = []
         satellites: list[str] = []
+        segment_nodes: list[str] = []
+        labels: dict[str, str] = {}
         
         for item in items:  
             edu_index = len(edus)
             if leaf():
                 if item.text:
                     edus.append(item.text)
+                    segment_nodes.append(f'{item.get('id')}_{annotator}')
 
             node_id = f'{item.get('id')}_{annotator}' if item.get('id') is not None else ''
             num_id = int(item.get('id', 0))
@@ -69,14 +217,17 @@ class RS3Parser():
             )
             edges.append(new_edge)
 
+            # relation names repeat on every node, share a single string object per name
+            relation = item.get('relname')
+            if relation is not None:
+                relation = sys.intern(relation)
+
             new_node = RelationNode(
-                relation=item.get('relname'),
-                nuclearity=relation_type.get(item.get('relname')),
+                relation=relation,
+                nuclearity=relation_type.get(relation),
                 id=node_id,
                 # numerical_id=num_id,
-                level=0,
                 annotator=annotator,
-                edus=[],
                 edu_index=edu_index,
                 is_leaf=False
             )
@@ -85,31 +236,138 @@ class RS3Parser():
             if new_node.nuclearity:
                 if new_node.nuclearity == 'S':
                     satellites.append(new_node.id)
-                new_node.label = f"{new_node.relation}, {new_node.nuclearity}" # + ', ' + item.get('id')
+                label = f"{new_node.relation}, {new_node.nuclearity}" # + ', ' + item.get('id')
+                new_node.label = labels.setdefault(label, label)
             else:
                 root_id = new_node.id
                 new_node.label = 'root'
 
-        constituent_tree_builder = ConstituentTreeBuilder(
-            nodes=nodes,
-            edges=edges,
-            root_id=root_id,
-            segments=edus,
-            satellite_node_ids=satellites
-        )
-        nodes_df, edges_df = constituent_tree_builder.build()
-
-        # TODO define the builder - OR - pass a flag to the builder
-        rs3_tree_builder = RS3TreeBuilder(
-            nodes=nodes,
-            edges=edges,
-            root_id=root_id,
-            segments=edus,
-            satellite_node_ids=satellites
-        )
-        nodes_df, edges_df = rs3_tree_builder.build()
-
-        # TODO merge the dataframes
-        # next is to display them correctly
-
-        return nodes_df, edges_df
\ No newline at end of file
+        # index the parsed tree once, every view builds on its own copy of the topology
+        topology = TreeTopology.from_tree(nodes, edges)
+
+        tree_builders = {}
+        for view in views:
+            tree_builders[view] = VIEW_BUILDERS[view](
+                nodes=nodes,
+                edges=edges,
+                root_id=root_id,
+                segments=edus,
+                satellite_node_ids=satellites,
+                edu_layer=edu_layer,
+                segment_node_ids=segment_nodes,
+                topology=topology
+            )
+        return tree_builders
+
+    def _worker_count(self) -> int:
+        return self.max_workers or os.cpu_count() or 1
+
+    def _collect_document(self, document: str, future: Future):
+        return self._with_document(document, *future.result())
+
+    @staticmethod
+    def _with_document(document: str, nodes: pd.DataFrame, edges: pd.DataFrame):
+        nodes['document'] = document
+        edges['document'] = document
+        return document, nodes, edges
+
+    def _concat_frames(self, frames: list[tuple[pd.DataFrame, pd.DataFrame]]):
+        """Concatenates per file `(nodes, edges)` frames in a single pass."""
+        if not frames:
+            return pd.DataFrame(), pd.DataFrame()
+
+        # align the categories first, concatenating categoricals that differ falls back to object columns
+        for column in CATEGORICAL_NODE_COLUMNS:
+            node_columns = [file_nodes[column] for file_nodes, _ in frames if column in file_nodes.columns]
+            if node_columns and all(isinstance(values.dtype, pd.CategoricalDtype) for values in node_columns):
+                categories = union_categoricals(node_columns).categories
+                for file_nodes, _ in frames:
+                    file_nodes[column] = file_nodes[column].cat.set_categories(categories)
+
+        # concatenate once, growing the frames file by file copies them over and over
+        nodes = pd.concat([file_nodes for file_nodes, _ in frames], ignore_index=True)
+        edges = pd.concat([file_edges for _, file_edges in frames], ignore_index=True)
+
+        if self.share_edus:
+            nodes = self._merge_shared_edus(nodes)
+        if self.align_segments:
+            nodes = align_segments(nodes, edges)
+        return nodes, edges
+
+    @staticmethod
+    def _merge_shared_edus(nodes: pd.DataFrame) -> pd.DataFrame:
+        """Keeps one row per shared EDU leaf, placed one level below the deepest tree that references it."""
+        shared = nodes['is_leaf'] & nodes['annotator'].isna()
+        if not shared.any():
+            return nodes
+
+        nodes.loc[shared, 'level'] = nodes.loc[shared].groupby('id')['level'].transform('max')
+        return nodes[~(shared & nodes.duplicated('id'))].reset_index(drop=True)
+
+    def _iter_body(self, file, relation_type: dict[str, str]) -> Iterator[ET.Element]:
+        """Loads the whole XML document, fills `relation_type` from the header and yields the <body> items."""
+        xml_tree = ET.parse(file)
+        relations = xml_tree.getroot().find("header/relations")
+        body = xml_tree.getroot().find("body")
+
+        if relations is None:
+            raise NotFoundErr("<relations> tag not found in the XML.")
+        if body is None:
+            raise NotFoundErr("<body> tag not found in the XML.")
+
+        self._read_relations(relations, relation_type)
+        yield from list(body)
+
+    def _iter_body_streaming(self, file, relation_type: dict[str, str]) -> Iterator[ET.Element]:
+        """Incrementally parses the XML document, fills `relation_type` from the header and yields the <body> items.
+
+        Every item is detached from the partially built tree once the caller is done with it, so memory use does
+        not grow with the number of segments. RS3 files declare the header before the body, the items of a body
+        that precedes the header are held until the relation types are known, as the DOM reader accepts both orders.
+        """
+        path: list[str] = []
+        relations_found = False
+        body = None
+        body_done = False
+        held: list[ET.Element] = []
+
+        def release(item: ET.Element) -> Iterator[ET.Element]:
+            yield item
+            item.clear()
+            body.remove(item)
+
+        for event, element in ET.iterparse(file, events=("start", "end")):
+            if event == "start":
+                path.append(element.tag)
+                if body is None and path[1:] == ["body"]:
+                    body = element
+                continue
+
+            if not relations_found and path[1:] == ["header", "relations"]:
+                self._read_relations(element, relation_type)
+                relations_found = True
+                element.clear()
+                for item in held:
+                    yield from release(item)
+                held.clear()
+            elif element is body:
+                body_done = True
+            elif body is not None and not body_done and len(path) == 3 and path[1] == "body":
+                if relations_found:
+                    yield from release(element)
+                else:
+                    held.append(element)
+            path.pop()
+
+        if not relations_found:
+            raise NotFoundErr("<relations> tag not found in the XML.")
+        if body is None:
+            raise NotFoundErr("<body> tag not found in the XML.")
+
+    @staticmethod
+    def _read_relations(relations: ET.Element, relation_type: dict[str, str]) -> None:
+        """Maps every declared relation name to the nuclearity of its children: 'S' for 'rst', 'N' otherwise."""
+        for relation in list(relations):
+            nuclearity = 'S' if relation.get('type') == 'rst' else 'N'
+            relation_type[relation.get('name')] = nuclearity
+        relation_type['span'] = 'N'
@@ -0,0 +1,223 @@
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+
+
+def align_segments(node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Expresses the EDU spans of all annotators in token offsets shared by every annotator of a document.
+
+    Annotators segmenting the same text differently number their EDUs differently, so their 'first_edu' and
+    'last_edu' cannot be compared. The tokens of every annotator's EDUs are read from the parsed segment texts of
+    its leaves ('text') and aligned with the tokens of the first annotator of the document (in sorted order), which define the shared
+    offsets. Identical token sequences are mapped one to one, others are diffed by `_match_tokens`.
+
+    Returns a copy of the node dataframe with the additional columns 'first_token' and 'last_token', the shared
+    offsets of the first and last token of each node's span (-1 for nodes without EDUs), and 'edu_tokens', the
+    shared offset of every EDU of the spans that also have an explicit 'edus' list.
+    """
+    result_dataframe = node_dataframe.copy()
+    first_token = np.full(len(result_dataframe), -1, dtype=np.int64)
+    last_token = np.full(len(result_dataframe), -1, dtype=np.int64)
+    edu_tokens = [None] * len(result_dataframe)
+
+    documents = result_dataframe["document"].astype(str).to_numpy() if "document" in result_dataframe.columns else np.zeros(len(result_dataframe), dtype=object)
+    annotators = result_dataframe["annotator"].astype(object).to_numpy()
+    first_edu = result_dataframe["first_edu"].to_numpy()
+    last_edu = result_dataframe["last_edu"].to_numpy()
+    explicit_edus = result_dataframe["edus"].to_numpy()
+    edu_index = result_dataframe["edu_index"].to_numpy()
+    texts = result_dataframe["text"].to_numpy()
+
+    # the leaves of every annotator, shared EDU leaves are reached through the edges of each annotator's tree
+    child_rows, parent_rows = _edge_rows(result_dataframe, edge_dataframe)
+    is_leaf = result_dataframe["is_leaf"].to_numpy()
+    leaf_edges = is_leaf[child_rows]
+    leaf_rows, leaf_annotators = child_rows[leaf_edges], annotators[parent_rows[leaf_edges]]
+
+    leaves: dict[str, dict[str, list[int]]] = {}
+    for row, annotator in zip(leaf_rows.tolist(), leaf_annotators.tolist()):
+        if isinstance(annotator, str):
+            leaves.setdefault(documents[row], {}).setdefault(annotator, []).append(row)
+
+    rows_of = pd.Series(np.arange(len(result_dataframe))).groupby([documents, annotators], sort=False).indices
+    for document, annotator_leaves in leaves.items():
+        token_spans = {}
+        reference = None
+        for annotator in sorted(annotator_leaves):
+            rows = annotator_leaves[annotator]
+            edu_starts, tokens = _edu_tokens(edu_index[rows], texts[rows])
+            if reference is None:
+                reference = tokens
+            start_map, end_map = _shared_offsets(reference, tokens)
+            token_spans[annotator] = (edu_starts, start_map, end_map)
+
+            # spans of the annotator's own nodes
+            rows = rows_of.get((document, annotator), np.empty(0, dtype=np.int64))
+            rows = rows[first_edu[rows] >= 0]
+            first_token[rows] = start_map[edu_starts[first_edu[rows]]]
+            last_token[rows] = end_map[edu_starts[last_edu[rows] + 1] - 1]
+            for row in rows[pd.notna(explicit_edus[rows])].tolist():
+                edu_tokens[row] = start_map[edu_starts[explicit_edus[row]]].tolist()
+
+        # shared leaves have no annotator, they take the offsets of the first annotator referencing them
+        for annotator in sorted(annotator_leaves, reverse=True):
+            edu_starts, start_map, end_map = token_spans[annotator]
+            rows = np.asarray(annotator_leaves[annotator], dtype=np.int64)
+            rows = rows[pd.isna(annotators[rows])]
+            first_token[rows] = start_map[edu_starts[edu_index[rows]]]
+            last_token[rows] = end_map[edu_starts[edu_index[rows] + 1] - 1]
+
+    result_dataframe["first_token"] = first_token
+    result_dataframe["last_token"] = last_token
+    result_dataframe["edu_tokens"] = edu_tokens
+    return result_dataframe
+
+
+def _edge_rows(node_dataframe: pd.DataFrame, edge_dataframe: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """Row positions of the child and the parent node of every edge, edges to unknown nodes ('root') dropped."""
+    def keys(dataframe: pd.DataFrame, column: str) -> np.ndarray:
+        if "document" in node_dataframe.columns and "document" in edge_dataframe.columns:
+            return (dataframe["document"].astype(str) + "\0" + dataframe[column].astype(str)).to_numpy()
+        return dataframe[column].astype(str).to_numpy()
+
+    # shared EDU leaves may occur several times in the node frame, their first row is used
+    node_keys = keys(node_dataframe, "id")
+    rows = pd.Series(np.arange(len(node_keys)), index=node_keys)
+    rows = rows[~rows.index.duplicated()]
+    child_rows = rows.index.get_indexer(keys(edge_dataframe, "from"))
+    parent_rows = rows.index.get_indexer(keys(edge_dataframe, "to"))
+    child_rows, parent_rows = np.where(child_rows >= 0, rows.to_numpy()[child_rows], -1), np.where(parent_rows >= 0, rows.to_numpy()[parent_rows], -1)
+    known = (child_rows >= 0) & (parent_rows >= 0)
+    return child_rows[known], parent_rows[known]
+
+
+def _edu_tokens(edu_indices: np.ndarray, texts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Token hashes of an annotator's EDUs in EDU order, and the offset of every EDU's first token.
+
+    The tokens are the whitespace separated words of the segment texts of the leaves, as parsed.
+    """
+    segments = [[] for _ in range(int(edu_indices.max(initial=-1)) + 1)]
+    for index, text in zip(edu_indices.tolist(), texts.tolist()):
+        segments[index] = text.split()
+    edu_starts = np.concatenate([[0], np.cumsum([len(tokens) for tokens in segments])]).astype(np.int64)
+    tokens = np.fromiter((token for tokens in segments for token in tokens), dtype=object, count=int(edu_starts[-1]))
+    return edu_starts, pd.util.hash_array(tokens)
+
+
+def _shared_offsets(reference: np.ndarray, tokens: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Maps the tokens of an annotator to the reference offsets a span starting or ending on them takes.
+
+    Unmatched tokens move a span start to the next matched token, and a span end back to the previous one.
+    """
+    if len(reference) == len(tokens) and np.array_equal(reference, tokens):
+        return np.arange(len(tokens)), np.arange(len(tokens))
+
+    matches = _match_tokens(reference, tokens)
+    positions = np.arange(len(tokens))
+    matched = matches >= 0
+    next_match = np.minimum.accumulate(np.where(matched, positions, len(tokens))[::-1])[::-1]
+    previous_match = np.maximum.accumulate(np.where(matched, positions, -1))
+    start_map = np.append(matches, len(reference))[next_match]
+    end_map = np.where(previous_match >= 0, matches[previous_match], -1)
+    return start_map, end_map
+
+
+def _match_tokens(reference: np.ndarray, tokens: np.ndarray) -> np.ndarray:
+    """Position of every token in `reference` it is aligned with, -1 for unmatched tokens.
+
+    A patience diff: the common prefix and suffix are matched, then the tokens occurring exactly once on both
+    sides whose order agrees (the longest increasing run of their positions) anchor the alignment, and the gaps
+    between anchors are aligned the same way. Where no token is unique, as in long texts of common words, runs of
+    2, 4, 8, ... tokens starting at each position are tried instead. Each round is O(n log n) array work over the
+    remaining gaps, and the anchors split the text so quickly that only a few rounds are needed.
+    """
+    matches = np.full(len(tokens), -1, dtype=np.int64)
+    gaps = [(0, len(reference), 0, len(tokens))]
+    while gaps:
+        reference_start, reference_end, start, end = gaps.pop()
+
+        length = min(reference_end - reference_start, end - start)
+        equal = reference[reference_start:reference_start + length] == tokens[start:start + length]
+        prefix = length if equal.all() else int(np.argmin(equal))
+        matches[start:start + prefix] = np.arange(reference_start, reference_start + prefix)
+        reference_start, start = reference_start + prefix, start + prefix
+
+        length = min(reference_end - reference_start, end - start)
+        equal = reference[reference_end - length:reference_end][::-1] == tokens[end - length:end][::-1]
+        suffix = length if equal.all() else int(np.argmin(equal))
+        matches[end - suffix:end] = np.arange(reference_end - suffix, reference_end)
+        reference_end, end = reference_end - suffix, end - suffix
+
+        if reference_start == reference_end or start == end:
+            continue
+
+        # anchor on unique tokens first, on unique runs of 2, 4, ... tokens when no single token is unique
+        gap_reference, gap_tokens = reference[reference_start:reference_end], tokens[start:end]
+        reference_anchors = anchors = np.empty(0, dtype=np.int64)
+        run = anchor_run = 1
+        while not anchors.size and min(len(gap_reference), len(gap_tokens)):
+            reference_anchors, anchors = _unique_anchors(gap_reference, gap_tokens)
+            anchor_run = run
+            gap_reference, gap_tokens = _double_ngrams(gap_reference, run), _double_ngrams(gap_tokens, run)
+            run *= 2
+        # a hash collision of two runs must not anchor different tokens, every token of the runs is compared
+        offsets = np.arange(anchor_run)
+        equal = (reference[(reference_anchors + reference_start)[:, None] + offsets] == tokens[(anchors + start)[:, None] + offsets]).all(axis=1)
+        reference_anchors, anchors = reference_anchors[equal], anchors[equal]
+        keep = _longest_increasing(reference_anchors)
+        if not keep.size:
+            continue
+        reference_anchors, anchors = reference_anchors[keep] + reference_start, anchors[keep] + start
+        matches[anchors] = reference_anchors
+
+        # the gaps before, between and after the anchors
+        gap_bounds = zip(
+            np.concatenate([[reference_start], reference_anchors + 1]).tolist(), np.concatenate([reference_anchors, [reference_end]]).tolist(),
+            np.concatenate([[start], anchors + 1]).tolist(), np.concatenate([anchors, [end]]).tolist(),
+        )
+        gaps.extend(gap for gap in gap_bounds if gap[0] < gap[1] and gap[2] < gap[3])
+    return matches
+
+
+def _double_ngrams(hashes: np.ndarray, length: int) -> np.ndarray:
+    """Hashes of the runs of `2 * length` tokens at every position, from the hashes of the runs of `length` tokens."""
+    count = max(len(hashes) - length, 0)
+    combined = (hashes[:count] * np.uint64(0x9E3779B97F4A7C15)) ^ hashes[length:length + count]
+    return combined ^ (combined >> np.uint64(31))
+
+
+def _unique_anchors(reference: np.ndarray, tokens: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Positions of the tokens occurring exactly once in both arrays, ordered by their position in `tokens`."""
+    reference_values, reference_positions, reference_counts = np.unique(reference, return_index=True, return_counts=True)
+    values, positions, counts = np.unique(tokens, return_index=True, return_counts=True)
+    _, reference_index, index = np.intersect1d(
+        reference_values[reference_counts == 1], values[counts == 1], assume_unique=True, return_indices=True
+    )
+    reference_anchors = reference_positions[reference_counts == 1][reference_index]
+    anchors = positions[counts == 1][index]
+    order = np.argsort(anchors)
+    return reference_anchors[order], anchors[order]
+
+
+def _longest_increasing(values: np.ndarray) -> np.ndarray:
+    """Indices of a longest strictly increasing subsequence of `values`, by patience sorting."""
+    tails: list[int] = []
+    tail_indices: list[int] = []
+    previous = np.full(len(values), -1, dtype=np.int64)
+    for index, value in enumerate(values.tolist()):
+        pile = bisect_left(tails, value)
+        if pile:
+            previous[index] = tail_indices[pile - 1]
+        if pile == len(tails):
+            tails.append(value)
+            tail_indices.append(index)
+        else:
+            tails[pile] = value
+            tail_indices[pile] = index
+
+    sequence = []
+    index = tail_indices[-1] if tail_indices else -1
+    while index >= 0:
+        sequence.append(index)
+        index = previous[index]
+    return np.array(sequence[::-1], dtype=np.int64)
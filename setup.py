@@ -46,7 +46,13 @@ setuptools.setup(
     install_requires=['dash>=1.19.0', 
                       'visdcc>=0.0.40', 
                       'pandas>=1.2.1', 
+                      'numpy>=1.20.0',
                       'dash_core_components>=1.15.0', 
                       'dash_html_components>=1.1.2', 
-                      'dash_bootstrap_components<1'],
+                      'dash_bootstrap_components<1',
+                      'pyarrow>=10.0.0',
+                      'flask>=1.0.4',
+                      'plotly>=4.0.0'],
+    # compiles the tree edit distance kernels, they run as plain Python without it
+    extras_require={'numba': ['numba>=0.57.0']},
 )
\ No newline at end of file
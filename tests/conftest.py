@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa".split()
+
+
+def rs3_document(segments, groups):
+    """An .rs3 document of `segments` `(id, parent, relname, text)` and `groups` `(id, type, parent, relname)`.
+
+    The root group has `None` as parent and relname.
+    """
+    def attributes(parent, relname):
+        return f' parent="{parent}" relname="{relname}"' if parent is not None else ''
+
+    body = [f'    <segment id="{i}"{attributes(parent, relname)}>{text}</segment>' for i, parent, relname, text in segments]
+    body += [f'    <group id="{i}" type="{kind}"{attributes(parent, relname)}/>' for i, kind, parent, relname in groups]
+    return "\n".join([
+        '<rst>', '  <header>', '    <relations>',
+        '      <rel name="elaboration" type="rst"/>', '      <rel name="cause" type="rst"/>',
+        '    </relations>', '  </header>', '  <body>', *body, '  </body>', '</rst>', '',
+    ])
+
+
+def random_tree(segments, seed, text_seed):
+    """The segments and groups of a random binary RST tree, about 3 * `segments` nodes once parsed (leaves included)."""
+    rng, text_rng = random.Random(seed), random.Random(text_seed)
+    texts = [" ".join(text_rng.choices(WORDS, k=5)) for _ in range(segments)]
+    parents, groups = {}, []
+
+    def build(first, last):
+        if first == last:
+            return first
+        middle = rng.randint(first, last - 1)
+        left, right = build(first, middle), build(middle + 1, last)
+        group = segments + len(groups) + 1
+        groups.append(group)
+        nucleus, satellite = (left, right) if rng.random() < 0.5 else (right, left)
+        parents[nucleus] = (group, "span")
+        # as in rs3 files, the satellite hangs from its nucleus
+        parents[satellite] = (nucleus, rng.choice(["elaboration", "cause"]))
+        return group
+
+    root = build(1, segments)
+    parents[root] = (None, None)
+    return (
+        [(i, *parents[i], text) for i, text in enumerate(texts, start=1)],
+        [(group, "span", *parents[group]) for group in groups],
+    )
+
+
+@pytest.fixture
+def write_rs3(tmp_path):
+    """Writes the `rs3_document` of `segments` and `groups` as `<tmp_path>/<annotator>/<document>.rs3` and returns
+    its path."""
+    def write(annotator, document, segments, groups):
+        (tmp_path / annotator).mkdir(exist_ok=True)
+        path = tmp_path / annotator / f"{document}.rs3"
+        path.write_text(rs3_document(segments, groups))
+        return path
+    return write
+
+
+@pytest.fixture
+def rs3_corpus(tmp_path, write_rs3):
+    """Writes `{document: {annotator: relation}}` as a `<tmp_path>/<annotator>/<document>.rs3` corpus and returns
+    `tmp_path`. Every file is the same three segment tree, the second segment is attached by `relation`."""
+    def write(annotations):
+        for document, relations in annotations.items():
+            for annotator, relation in relations.items():
+                segments = [
+                    (1, 4, "span", "first segment of the text"),
+                    (2, 4, relation, "second segment"),
+                    (3, 5, "span", "third segment"),
+                ]
+                write_rs3(annotator, document, segments, [(4, "span", 3, "elaboration"), (5, "span", None, None)])
+        return tmp_path
+    return write
+
+
+@pytest.fixture
+def random_rs3(write_rs3):
+    """Writes a random tree over `segments` segments as `<tmp_path>/<annotator>/<document>.rs3` and returns its path.
+
+    The segment texts only depend on the document, all annotators of a document segment the same text.
+    """
+    def write(annotator, document, segments, seed):
+        return write_rs3(annotator, document, *random_tree(segments, seed, text_seed=document))
+    return write
@@ -0,0 +1,53 @@
+import pandas as pd
+
+from jaal.jaal.agreement_cube import AgreementCube
+from jaal.jaal.agreement_matrix import AgreementMatrix
+from jaal.jaal.annotator_agreement import AGREEMENT_GRANULARITIES
+from jaal.rs3_parser_ import RS3Parser
+
+
+def test_from_corpus_with_annotator_missing_from_a_document(rs3_corpus):
+    # the first document lacks 'a3', which the annotator index must still hold for the second one
+    corpus = rs3_corpus({
+        "doc1": {"a1": "cause", "a2": "cause"},
+        "doc2": {"a1": "cause", "a2": "elaboration", "a3": "cause"},
+    })
+    cube = AgreementCube.from_corpus(RS3Parser(), corpus)
+
+    assert cube.categories("annotator_pair") == ["a1 / a2", "a1 / a3", "a2 / a3"]
+    sizes = cube.pivot(index="document", columns="annotator_pair", metric="size_a", granularity="span")
+    # pairs only have cells in the documents both annotators annotated
+    assert sizes.loc["doc1"].dropna().index.tolist() == ["a1 / a2"]
+    assert sizes.loc["doc2"].notna().all()
+
+    f1 = cube.pivot(index="granularity", columns="annotator_pair", metric="f1")
+    assert f1.loc["full", "a1 / a3"] == 1.0
+    assert f1.loc["span", "a1 / a2"] == 1.0
+    assert f1.loc["full", "a1 / a2"] < 1.0
+
+
+def test_relation_cells_are_bounded_and_totals_match_the_agreement_matrix(rs3_corpus, random_rs3):
+    # a1 and a2 agree on the span of the second segment, but not on its relation
+    corpus = rs3_corpus({"doc1": {"a1": "cause", "a2": "elaboration"}})
+    for annotator, seed in [("a1", 1), ("a2", 2), ("a3", 1)]:
+        random_rs3(annotator, "doc2", 30, seed=seed)
+    parser = RS3Parser()
+    cube = AgreementCube.from_corpus(parser, corpus)
+
+    span = cube.pivot(index="relation", columns="annotator_pair", metric="matches", granularity="span", documents=["doc1"])
+    assert span.loc["cause", "a1 / a2"] == span.loc["elaboration", "a1 / a2"] == 0
+    assert cube.pivot(index="granularity", columns="annotator_pair", metric="f1", documents=["doc1"]).loc["span", "a1 / a2"] == 1
+    for granularity in AGREEMENT_GRANULARITIES:
+        for index in ["relation", "document"]:
+            for metric in ["precision", "recall", "f1"]:
+                values = cube.pivot(index=index, columns="annotator_pair", metric=metric, granularity=granularity, relations=["cause", "elaboration", "span"])
+                assert ((values >= 0) & (values <= 1) | values.isna()).all().all()
+
+    # over all relations the cube counts the spans the agreement matrix does
+    nodes = pd.concat([frame for _, frame, _ in parser.parse_corpus(corpus)], ignore_index=True)
+    agreement = AgreementMatrix().compute(nodes).set_index(["annotator_a", "annotator_b", "level"])
+    for granularity in AGREEMENT_GRANULARITIES:
+        counts = {metric: cube.pivot(index="granularity", columns="annotator_pair", metric=metric).loc[granularity] for metric in ["size_a", "size_b", "matches"]}
+        for pair in cube.categories("annotator_pair"):
+            expected = agreement.loc[(*pair.split(" / "), granularity)]
+            assert [counts[metric][pair] for metric in ["size_a", "size_b", "matches"]] == [expected["size_a"], expected["size_b"], expected["matches"]]
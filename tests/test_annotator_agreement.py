@@ -0,0 +1,55 @@
+import pandas as pd
+
+from jaal.jaal.annotator_agreement import AGREEMENT_GRANULARITIES, AgreementIndex, AnnotatorAgreement
+from jaal.rs3_parser_ import RS3Parser
+
+AGREEMENT_COLUMNS = [*AGREEMENT_GRANULARITIES.values(), "subtree_agreement"]
+
+
+def agreements(parser, files):
+    """The nodes of `files` parsed by `parser`, with the agreement and subtree agreement of every node."""
+    node_dataframe, edge_dataframe = parser.parse_files(files)
+    agreement = AnnotatorAgreement()
+    return agreement.find_subtree_agreements(agreement.find_agreements(node_dataframe), edge_dataframe)
+
+
+def test_shared_edus_agree_as_per_annotator_edus(random_rs3):
+    # 'a' and 'c' annotate the same tree, 'b' another one over the same segments
+    files = {"a": random_rs3("a", "doc", 20, seed=1), "b": random_rs3("b", "doc", 20, seed=2), "c": random_rs3("c", "doc", 20, seed=1)}
+
+    for view in ["constituent", "rst"]:
+        own = agreements(RS3Parser(view=view), files)
+        shared = agreements(RS3Parser(view=view, share_edus=True), files)
+
+        # internal nodes keep their ids, their agreement does not depend on how the leaves are stored
+        inner = shared[shared["annotator"].notna()].set_index("id")[AGREEMENT_COLUMNS]
+        pd.testing.assert_frame_equal(inner, own[own["id"].isin(inner.index)].set_index("id")[AGREEMENT_COLUMNS])
+
+        # a shared leaf agrees like every annotator's own copy of it
+        leaves = shared[shared["annotator"].isna()]
+        assert leaves["is_leaf"].all() and len(leaves) == 20
+        own_leaves = own[own["is_leaf"]].groupby("label")[AGREEMENT_COLUMNS].agg(["min", "max"])
+        for column in AGREEMENT_COLUMNS:
+            assert (own_leaves[(column, "min")] == own_leaves[(column, "max")]).all()
+            assert leaves.set_index("label")[column].sort_index().tolist() == own_leaves[(column, "min")].sort_index().tolist()
+
+
+def test_incremental_agreement_matches_full_recompute(random_rs3, tmp_path):
+    for document, seed in [("doc1", 1), ("doc2", 2)]:
+        for annotator, offset in [("a", 0), ("b", 0), ("c", 10)]:
+            random_rs3(annotator, document, 15, seed=seed + offset)
+
+    for parser in [RS3Parser(), RS3Parser(share_edus=True)]:
+        random_rs3("b", "doc2", 15, seed=2)
+        nodes = pd.concat([frame for _, frame, _ in parser.parse_corpus(tmp_path)], ignore_index=True)
+        index = AgreementIndex(nodes, annotators=["a", "b", "c"])
+
+        # 'b' annotates 'doc2' as 'a' does, then switches to the tree of 'c', then to one nobody else has
+        for seed in [12, 99]:
+            random_rs3("b", "doc2", 15, seed=seed)
+            edited = {document: frame for document, frame, _ in parser.parse_corpus(tmp_path)}["doc2"]
+            updated = index.replace_annotator("b", edited)
+
+            expected = AnnotatorAgreement(["a", "b", "c"]).find_agreements(updated)
+            for column in AGREEMENT_GRANULARITIES.values():
+                assert updated[column].tolist() == expected[column].tolist()
@@ -0,0 +1,76 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jaal.jaal import Jaal
+from jaal.jaal.annotator_agreement import AnnotatorAgreement
+from jaal.jaal.graph_session import GraphSession, GraphSessions, RenderCache
+from jaal.rs3_parser_ import RS3Parser
+
+
+@pytest.fixture
+def dashboard(random_rs3):
+    """A dashboard of the constituent and rst views of two annotators of one document."""
+    files = {"a": random_rs3("a", "doc", 10, seed=1), "b": random_rs3("b", "doc", 10, seed=2)}
+    agreement = AnnotatorAgreement()
+    views = {
+        view: {"nodes": agreement.find_subtree_agreements(agreement.find_agreements(nodes), edges), "edges": edges}
+        for view, (nodes, edges) in RS3Parser().parse_files_views(files).items()
+    }
+    return Jaal(views["constituent"]["edges"], views["constituent"]["nodes"], views=views)
+
+
+def test_update_without_annotator_shows_every_annotator(dashboard):
+    session = GraphSession(dashboard._callback_tree_type("constituent"), "constituent")
+    session.show("a", False, "full")
+    assert not session.visible.all()
+
+    # the annotator select has no value until one is chosen
+    script = dashboard._callback_update_graph(session, None, True, "full")
+    assert session.visible.all() and '{"hidden":false}' in script
+
+
+def run_update_graph(app, triggered, *arguments):
+    """Calls the callback updating the graph as dash does when `triggered` changed."""
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+
+    update_graph = next(callback["callback"] for output, callback in app.callback_map.items() if output == "graph.run")
+    token = context_value.set(AttributeDict(triggered_inputs=[{"prop_id": triggered, "value": None}]))
+    try:
+        return update_graph.__wrapped__(*arguments)
+    finally:
+        context_value.reset(token)
+
+
+def test_view_toggle_without_annotator_shows_every_annotator(dashboard):
+    app = dashboard.create()
+    client = app.server.test_client()
+    every_annotator = client.get("/_jaal/graph?view=rst&annotator=All").get_json()
+
+    session_id = dashboard.sessions.new(dashboard.view_masks[None])
+    for input_id, session in [("view_toggle.value", session_id), ("overlay_checkbox.checked", "unknown session")]:
+        script = run_update_graph(app, input_id, False, None, "rst", "full", None, session)
+        url = json.JSONDecoder().raw_decode(script, script.index("fetch(") + len("fetch("))[0]
+        assert client.get(url).get_json() == every_annotator
+    assert dashboard.sessions.get(session_id).visible.all()
+
+
+def test_sessions_and_render_cache_stay_bounded_under_concurrent_callbacks(dashboard):
+    sessions, cache = GraphSessions(max_sessions=8), RenderCache(max_bytes=1000)
+    masks = dashboard.view_masks[None]
+
+    def callback(request):
+        session_id = sessions.new(masks)
+        sessions.get(session_id)
+        for key in range(request % 7, 50, 7):
+            cache.get_or_render(key, lambda: "x" * (10 + key))
+        return session_id
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(callback, range(400)))
+
+    assert len(sessions) == 8
+    assert cache.size == sum(map(len, cache._entries.values())) <= cache.max_bytes
+    assert cache.hits + cache.misses == sum(len(range(request % 7, 50, 7)) for request in range(400))
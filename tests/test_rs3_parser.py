@@ -0,0 +1,69 @@
+from xml.dom import NotFoundErr
+
+import pandas as pd
+import pytest
+
+from jaal.rs3_cache import RS3Cache
+from jaal.rs3_parser_ import RS3Parser
+
+
+def assert_frames_equal(frames, expected):
+    """Asserts two `(nodes, edges)` pairs are equal."""
+    pd.testing.assert_frame_equal(frames[0], expected[0])
+    pd.testing.assert_frame_equal(frames[1], expected[1])
+
+
+def test_streaming_matches_dom(random_rs3):
+    files = {"a": random_rs3("a", "doc", 40, seed=1), "b": random_rs3("b", "doc", 40, seed=2)}
+
+    for view in ["constituent", "rst"]:
+        assert_frames_equal(RS3Parser(streaming=True, view=view).parse_files(files), RS3Parser(view=view).parse_files(files))
+
+
+def test_streaming_accepts_body_before_header(random_rs3):
+    path = random_rs3("a", "doc", 20, seed=1)
+    expected = RS3Parser().parse_files({"a": path})
+    text = path.read_text()
+    header = text[text.index("  <header>"):text.index("  <body>")]
+    path.write_text(text.replace(header, "").replace("</rst>", header + "</rst>"))
+
+    assert_frames_equal(RS3Parser(streaming=True).parse_files({"a": path}), expected)
+    assert_frames_equal(RS3Parser().parse_files({"a": path}), expected)
+
+
+def test_streaming_without_relations_raises(random_rs3):
+    path = random_rs3("a", "doc", 5, seed=1)
+    text = path.read_text()
+    path.write_text(text[:text.index("    <relations>")] + text[text.index("    </relations>") + len("    </relations>\n"):])
+
+    with pytest.raises(NotFoundErr):
+        RS3Parser(streaming=True).parse_files({"a": path})
+
+
+def test_cache_hashes_each_file_once_for_all_views(random_rs3, tmp_path, monkeypatch):
+    files = {"a": random_rs3("a", "doc", 10, seed=1), "b": random_rs3("b", "doc", 10, seed=2)}
+    cache = RS3Cache(tmp_path / "cache")
+    hashed = []
+    content_hash = RS3Cache.content_hash
+    monkeypatch.setattr(RS3Cache, "content_hash", staticmethod(lambda file: hashed.append(file) or content_hash(file)))
+
+    parsed = RS3Parser(cache=cache).parse_files_views(files)
+    assert sorted(hashed) == sorted(files.values())
+    # the second parse loads every view from the cache
+    cached = RS3Parser(cache=cache).parse_files_views(files)
+    for view in parsed:
+        assert_frames_equal(cached[view], parsed[view])
+
+
+def test_parallel_corpus_matches_serial(random_rs3, tmp_path):
+    for document, seed in [("doc1", 1), ("doc2", 2), ("doc3", 3)]:
+        for annotator in ["a", "b"]:
+            random_rs3(annotator, document, 15, seed=seed + ord(annotator))
+    random_rs3("c", "doc2", 15, seed=4)  # annotates a single document
+
+    serial = list(RS3Parser().parse_corpus(tmp_path))
+    parallel = list(RS3Parser(max_workers=2).parse_corpus(tmp_path))
+
+    assert [document for document, *_ in parallel] == [document for document, *_ in serial] == ["doc1", "doc2", "doc3"]
+    for (_, *frames), (_, *expected) in zip(parallel, serial):
+        assert_frames_equal(frames, expected)
@@ -0,0 +1,35 @@
+from jaal.rs3_parser_ import RS3Parser
+from jaal.segment_alignment import align_segments
+
+
+def parse_segmentations(write_rs3):
+    """Parses 'a', which segments the text in three EDUs, and 'b', which merges the first two of them."""
+    files = {
+        "a": write_rs3("a", "doc", [
+            (1, 4, "span", "the cat sat"), (2, 1, "elaboration", "on the mat"), (3, 1, "cause", "and then slept"),
+        ], [(4, "span", None, None)]),
+        "b": write_rs3("b", "doc", [
+            (1, 3, "span", "the cat sat on the mat"), (2, 1, "cause", "and then slept"),
+        ], [(3, "span", None, None)]),
+    }
+    return RS3Parser().parse_files(files)
+
+
+def test_differing_segmentations_share_token_offsets(write_rs3):
+    node_dataframe, edge_dataframe = parse_segmentations(write_rs3)
+    aligned = align_segments(node_dataframe, edge_dataframe).set_index("id")
+
+    offsets = aligned[["first_token", "last_token"]].apply(tuple, axis=1)
+    assert offsets["1_a_edu"] == (0, 2) and offsets["2_a_edu"] == (3, 5) and offsets["1_b_edu"] == (0, 5)
+    # both roots cover the whole text, and both attach the last segment by 'cause'
+    assert offsets["4_a"] == offsets["3_b"] == (0, 8)
+    assert offsets["3_a"] == offsets["2_b"] == (6, 8)
+
+
+def test_alignment_does_not_depend_on_the_labels(write_rs3):
+    node_dataframe, edge_dataframe = parse_segmentations(write_rs3)
+    expected = align_segments(node_dataframe, edge_dataframe)
+
+    # labels are only for display, e.g. without the EDU number or wrapped differently
+    relabeled = align_segments(node_dataframe.assign(label="1. the label"), edge_dataframe)
+    assert relabeled[["first_token", "last_token"]].equals(expected[["first_token", "last_token"]])
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from jaal.jaal import tree_edit_distance
+from jaal.jaal.tree_edit_distance import TreeEditDistance
+from jaal.rs3_parser_ import RS3Parser
+
+
+def parse_pair(random_rs3, segments, seed_a, seed_b):
+    """Parses two random trees over the same segments as the annotators 'a' and 'b' of one document."""
+    return RS3Parser().parse_files({"a": random_rs3("a", "doc", segments, seed_a), "b": random_rs3("b", "doc", segments, seed_b)})
+
+
+def test_identical_trees_align_without_edits(random_rs3):
+    node_dataframe, edge_dataframe = parse_pair(random_rs3, 50, seed_a=1, seed_b=1)
+    aligned = TreeEditDistance().align(node_dataframe, edge_dataframe, "a", "b")
+
+    assert aligned.attrs["tree_edit_distance"] == 0
+    operations = aligned.loc[aligned["annotator"].isin(["a", "b"]), "edit_operation"]
+    assert set(operations) == {"match"}
+
+
+def test_distance_matches_alignment(random_rs3):
+    node_dataframe, edge_dataframe = parse_pair(random_rs3, 50, seed_a=1, seed_b=2)
+    ted = TreeEditDistance()
+    aligned = ted.align(node_dataframe, edge_dataframe, "a", "b")
+
+    distance = ted.distance(node_dataframe, edge_dataframe, "a", "b")
+    assert distance == aligned.attrs["tree_edit_distance"] > 0
+    # every unit of the distance is one deleted, inserted or renamed node
+    operations = aligned["edit_operation"].value_counts()
+    assert distance == operations.get("delete", 0) + operations.get("insert", 0) + operations.get("rename", 0) // 2
+
+
+def test_plain_python_kernels_match_compiled(random_rs3, monkeypatch):
+    pytest.importorskip("numba")
+    node_dataframe, edge_dataframe = parse_pair(random_rs3, 20, seed_a=1, seed_b=2)
+    ted = TreeEditDistance()
+    expected = ted.align(node_dataframe, edge_dataframe, "a", "b")
+
+    # the loops as they run when Numba is not installed
+    monkeypatch.setattr(tree_edit_distance, "_keyroot_distances", tree_edit_distance._keyroot_distances.py_func)
+    monkeypatch.setattr(tree_edit_distance, "_fill_forest", tree_edit_distance._fill_forest.py_func)
+    aligned = ted.align(node_dataframe, edge_dataframe, "a", "b")
+    assert aligned.attrs["tree_edit_distance"] == expected.attrs["tree_edit_distance"]
+    assert aligned["edit_operation"].tolist() == expected["edit_operation"].tolist()
+
+
+def test_distance_of_2k_node_trees_takes_under_a_second(random_rs3):
+    pytest.importorskip("numba")
+    node_dataframe, edge_dataframe = parse_pair(random_rs3, 700, seed_a=1, seed_b=2)
+    ted = TreeEditDistance()
+    ted.distance(node_dataframe, edge_dataframe, "a", "b")  # compiles the kernels
+
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        ted.distance(node_dataframe, edge_dataframe, "a", "b")
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < 1.0
@@ -1,4 +1,5 @@
-from collections import deque
+import numpy as np
+
 from jaal.tree_builder.tree_builder import TreeBuilder
 
 
@@ -6,29 +7,10 @@ class RS3TreeBuilder(TreeBuilder):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def redirect_edges(self) -> None: # TODO implement
-        """Replaces the parent by the grandparent for each satellite node according to the structure of a constituent tree."""
-        edges_c2p_dict = self.edges_as_c2p_dict()
-
-        for edge in self.edges:
-            if edge.child in self.satellite_node_ids:
-                parent = edge.parent
-                grandparent = edges_c2p_dict.get(parent)
-                if grandparent is not None:
-                    edge.parent = grandparent
-
-    def assign_depth_levels(self): # TODO implement
-        """Performs Breadth First Search to assign tree depth level to each node."""
-        edges_c2p_dict = self.edges_as_p2c_dict()
-        levels = {}
-        queue = deque([(self.root_id, 0)])  # Each element is (node_id, level)
-
-        while queue:
-            node, level = queue.popleft()
-            levels[node] = level
-
-            for child in edges_c2p_dict.get(node, []):
-                queue.append((child, level + 1))
+    def redirect_edges(self) -> None:
+        """Keeps the edges as annotated in the RS3 file, satellites stay below their nucleus."""
+        pass
 
-        for node in self.nodes:
-            node.level = levels[node.id]
\ No newline at end of file
+    def edu_parents(self) -> np.ndarray:
+        """Attaches the EDU leaf to every segment, nuclei with satellites below them keep their own text."""
+        return self.topology.indices(self.segment_node_ids)
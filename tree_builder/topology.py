@@ -0,0 +1,202 @@
+import numpy as np
+
+
+class TreeTopology():
+    """Integer indexed parent/children structure of the tree held by a `TreeBuilder`.
+
+    Every node gets an integer id in the order of the builder's node list. Parent ids referenced by edges that are
+    not nodes themselves (the 'root' placeholder above the root node) get an id as well, but no node position. The
+    tree is kept as a NumPy array of parent ids (-1 for none) plus CSR style child offsets, which are rebuilt lazily
+    after the parents change.
+    """
+    def __init__(self, ids: list[str], parent: np.ndarray, edge_index: np.ndarray, node_position: np.ndarray):
+        """
+        Parameters
+        -------------
+        ids: list[str]
+            string id of every entry, the nodes first
+
+        parent: np.ndarray
+            integer id of each entry's parent, -1 for none
+
+        edge_index: np.ndarray
+            position of each entry's edge in the builder's edge list, -1 for none
+
+        node_position: np.ndarray
+            position of each entry in the builder's node list, -1 for entries that are not nodes
+        """
+        self.ids = ids
+        self.index: dict[str, int] = {}
+        for position, node_id in enumerate(ids):
+            self.index.setdefault(node_id, position)
+        self.parent = parent
+        self.edge_index = edge_index
+        self.node_position = node_position
+
+        self._child_offsets: np.ndarray | None = None
+        self._children: np.ndarray | None = None
+
+    @classmethod
+    def from_tree(cls, nodes: list, edges: list) -> 'TreeTopology':
+        """Indexes the nodes and edges of a builder, a child listed by several edges keeps the parent of the last."""
+        ids = [node.id for node in nodes]
+        index: dict[str, int] = {}
+        for position, node_id in enumerate(ids):
+            index.setdefault(node_id, position)
+
+        def entry(entry_id: str) -> int:
+            position = index.get(entry_id)
+            if position is None:
+                position = index[entry_id] = len(ids)
+                ids.append(entry_id)
+            return position
+
+        edge_of_child = {entry(edge.child): position for position, edge in enumerate(edges)}
+        parent_of_child = {child: entry(edges[position].parent) for child, position in edge_of_child.items()}
+
+        parent = np.full(len(ids), -1, dtype=np.int64)
+        edge_index = np.full(len(ids), -1, dtype=np.int64)
+        if edge_of_child:
+            children = np.fromiter(edge_of_child.keys(), dtype=np.int64, count=len(edge_of_child))
+            parent[children] = np.fromiter(parent_of_child.values(), dtype=np.int64, count=len(edge_of_child))
+            edge_index[children] = np.fromiter(edge_of_child.values(), dtype=np.int64, count=len(edge_of_child))
+        node_position = np.full(len(ids), -1, dtype=np.int64)
+        node_position[:len(nodes)] = np.arange(len(nodes))
+        return cls(ids, parent, edge_index, node_position)
+
+    def copy(self) -> 'TreeTopology':
+        """Returns an independent copy, changing its parents leaves this topology untouched."""
+        return TreeTopology(list(self.ids), self.parent.copy(), self.edge_index.copy(), self.node_position.copy())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def indices(self, ids: list[str]) -> np.ndarray:
+        """Maps string node ids to integer ids, unknown ids are dropped."""
+        index = self.index
+        return np.fromiter((index[node_id] for node_id in ids if node_id in index), dtype=np.int64)
+
+    def node_entries(self) -> np.ndarray:
+        """Integer id of every node, in the order of the builder's node list."""
+        is_node = self.node_position >= 0
+        entries = np.empty(np.count_nonzero(is_node), dtype=np.int64)
+        entries[self.node_position[is_node]] = np.flatnonzero(is_node)
+        return entries
+
+    def set_parents(self, nodes: np.ndarray, parents: np.ndarray) -> None:
+        """Moves the given nodes under new parents in place."""
+        self.parent[nodes] = parents
+        self._child_offsets = self._children = None
+
+    def add_nodes(self, ids: list[str], parents: np.ndarray, edge_index: np.ndarray, node_position: np.ndarray) -> np.ndarray:
+        """Appends new nodes below the given parents and returns their integer ids."""
+        start = len(self.ids)
+        for position, node_id in enumerate(ids, start):
+            self.index.setdefault(node_id, position)
+        self.ids.extend(ids)
+        self.parent = np.concatenate([self.parent, np.asarray(parents, dtype=np.int64)])
+        self.edge_index = np.concatenate([self.edge_index, np.asarray(edge_index, dtype=np.int64)])
+        self.node_position = np.concatenate([self.node_position, np.asarray(node_position, dtype=np.int64)])
+        self._child_offsets = self._children = None
+        return np.arange(start, len(self.ids), dtype=np.int64)
+
+    @property
+    def child_offsets(self) -> np.ndarray:
+        """CSR offsets, the children of node `i` are `children[child_offsets[i]:child_offsets[i + 1]]`."""
+        if self._child_offsets is None:
+            self._build_children()
+        return self._child_offsets
+
+    @property
+    def children(self) -> np.ndarray:
+        """Integer ids of all children grouped by parent, in node order within each group."""
+        if self._children is None:
+            self._build_children()
+        return self._children
+
+    def child_counts(self) -> np.ndarray:
+        return np.diff(self.child_offsets)
+
+    def children_of(self, node: int) -> np.ndarray:
+        offsets = self.child_offsets
+        return self.children[offsets[node]:offsets[node + 1]]
+
+    def children_of_many(self, nodes: np.ndarray) -> np.ndarray:
+        """Concatenates the children of all given nodes without a Python loop."""
+        offsets = self.child_offsets
+        starts = offsets[nodes]
+        counts = offsets[nodes + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        # position of every gathered child inside `children`: its group start plus its rank within the group
+        group_starts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return self.children[group_starts + np.arange(total)]
+
+    def leaves(self) -> np.ndarray:
+        """Integer ids of the nodes that have a parent but no children, in node order."""
+        return np.flatnonzero((self.parent >= 0) & (self.child_counts() == 0) & (self.node_position >= 0))
+
+    def bfs_frontiers(self, root: int) -> list[np.ndarray]:
+        """Integer ids of the nodes below `root` grouped by depth, the root alone first."""
+        frontiers = []
+        frontier = np.array([root], dtype=np.int64)
+        while frontier.size:
+            frontiers.append(frontier)
+            frontier = self.children_of_many(frontier)
+        return frontiers
+
+    def depth_levels(self, root: int) -> np.ndarray:
+        """Depth of every node below `root`, computed by pointer jumping; -1 for unreachable nodes."""
+        return tree_levels([self.parent], [root])[0]
+
+    def descendants(self, node: int) -> np.ndarray:
+        """Integer ids of all nodes below `node`."""
+        frontiers = self.bfs_frontiers(node)[1:]
+        return np.concatenate(frontiers) if frontiers else np.empty(0, dtype=np.int64)
+
+    def _build_children(self) -> None:
+        has_parent = self.parent >= 0
+        nodes = np.flatnonzero(has_parent)
+        # stable sort keeps siblings in node order
+        self._children = nodes[np.argsort(self.parent[nodes], kind='stable')]
+        counts = np.bincount(self.parent[nodes], minlength=len(self.ids))
+        self._child_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def tree_levels(parents: list[np.ndarray], roots: list[int]) -> list[np.ndarray]:
+    """Depth of every node below the root of each tree, for many trees in one batched call; -1 for nodes that are
+    not below their tree's root.
+
+    The parent arrays are concatenated into a single forest, whose depths are found by pointer jumping: every node
+    repeatedly replaces its ancestor by its ancestor's ancestor, adding up the distances, until it reaches the top of
+    its tree. This takes O(log depth) rounds of array operations over all trees at once, with no per node Python work.
+    """
+    sizes = np.fromiter(map(len, parents), dtype=np.int64, count=len(parents))
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    if not offsets[-1]:
+        return [np.empty(0, dtype=np.int64) for _ in parents]
+
+    parent = np.concatenate([np.where(tree_parent >= 0, tree_parent + offset, -1) for tree_parent, offset in zip(parents, offsets[:-1].tolist())])
+    roots = np.asarray(roots, dtype=np.int64) + offsets[:-1]
+
+    nodes = np.arange(len(parent))
+    # the roots (and nodes without a parent) point to themselves, so the walk up stops there
+    ancestor = np.where(parent >= 0, parent, nodes)
+    ancestor[roots] = roots
+    depth = (ancestor != nodes).astype(np.int64)
+
+    active = np.flatnonzero(ancestor[ancestor] != ancestor)
+    for _ in range(len(parent).bit_length() + 1):
+        if not active.size:
+            break
+        jump = ancestor[active]
+        depth[active] += depth[jump]
+        ancestor[active] = ancestor[jump]
+        active = active[ancestor[ancestor[active]] != ancestor[active]]
+    else:
+        if active.size:
+            raise ValueError("The parent arrays contain a cycle")
+
+    levels = np.where(ancestor == np.repeat(roots, sizes), depth, -1)
+    return np.split(levels, offsets[1:-1])
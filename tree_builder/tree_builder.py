@@ -1,43 +1,120 @@
 from abc import abstractmethod
-from dataclasses import dataclass, field
+import hashlib
+from dataclasses import dataclass
+from operator import attrgetter
 from typing import Literal
+import numpy as np
 import pandas as pd
 
+from jaal.tree_builder.topology import TreeTopology, tree_levels
 from jaal.tree_builder.utils import wrap_text
 
-@dataclass
+# Node records only hold what is parsed from the file, the tree dependent values ('level', the EDU span) are kept
+# by the builder as arrays and joined in when the nodes are converted to a DataFrame.
+@dataclass(slots=True)
 class RelationNode():
     id: str
 
     relation: str | None =None
     nuclearity: Literal['S', 'N'] | None =None
-    level: int =0
     annotator: str | None =None
-    edus: list[int] =field(default_factory=list)
     edu_index: int =0
     # shape: str # NOTE can be defined based on 'is_leaf'
     #  'font': {'multi': True},  # Enable multiline support = based on 'is_leaf'
     is_leaf: bool =False
 
     label: str =''
+    # segment text of EDU leaves, as parsed (the label wraps it for display)
+    text: str | None =None
 
-@dataclass 
+@dataclass(slots=True)
 class Edge():
     child: str
     parent: str
 
 
+# low cardinality node columns, stored as pandas categoricals
+CATEGORICAL_NODE_COLUMNS = ['relation', 'nuclearity', 'annotator']
+
+
+class EduLayer():
+    """EDU leaf nodes of one document, built once and shared by reference by the trees of all its annotators.
+
+    Shared leaves have no annotator. They are identified by the EDU index and a digest of the segment text, so
+    annotators only share the leaves whose segments are identical, and layers built in different processes agree
+    on the ids.
+    """
+    def __init__(self):
+        self.nodes: dict[tuple[int, str], RelationNode] = {}
+
+    def node(self, edu_index: int, segment: str) -> RelationNode:
+        """Returns the leaf node of an EDU, creating it on first use."""
+        node = self.nodes.get((edu_index, segment))
+        if node is None:
+            digest = hashlib.blake2b(segment.encode(), digest_size=4).hexdigest()
+            node = self.nodes[(edu_index, segment)] = RelationNode(
+                id=f'edu_{edu_index}_{digest}',
+                edu_index=edu_index,
+                is_leaf=True,
+                label=wrap_text(f"{edu_index + 1}. {segment}"),
+                text=segment
+            )
+        return node
+
+
 class TreeBuilder():
-    def __init__(self, nodes: list[RelationNode] =[], edges: list[Edge] =[], root_id: str ='', segments: list[str] =[], satellite_node_ids: list[str] =[]):
-        self.nodes = nodes
-        self.edges = edges
+    """Builds one view of a parsed RS3 tree.
+
+    Builders never modify the nodes, edges or topology they are given, so several builders (views) can be derived
+    from the same parsed base tree.
+    """
+    def __init__(self, nodes: list[RelationNode] =[], edges: list[Edge] =[], root_id: str ='', segments: list[str] =[], satellite_node_ids: list[str] =[], discontinuous_edus: bool =True, edu_layer: EduLayer | None =None, segment_node_ids: list[str] =[], topology: TreeTopology | None =None):
+        self.nodes = list(nodes)
+        self.edges = list(edges)
         self.root_id = root_id
         self.segments = segments
         self.satellite_node_ids = satellite_node_ids
+        # nodes parsed from <segment> items that carry an EDU
+        self.segment_node_ids = segment_node_ids
+        # topology of the given nodes and edges, shared by all views of a parse
+        self.base_topology = topology
+        # whether nodes with a non-contiguous span also get their explicit 'edus' list
+        self.discontinuous_edus = discontinuous_edus
+        # EDU leaves shared with the other annotators of the document, if any
+        self.edu_layer = edu_layer
 
     def build(self):
+        self.init_tree()
         self.redirect_edges()
         self.assign_depth_levels()
+        return self.complete_tree()
+
+    @staticmethod
+    def build_many(builders: list['TreeBuilder']) -> list[tuple[pd.DataFrame, pd.DataFrame]]:
+        """Builds several trees, e.g. the views of all annotations of a document, assigning the depth levels of all
+        of them in one batched call."""
+        for builder in builders:
+            builder.init_tree()
+            builder.redirect_edges()
+
+        topologies = [builder.topology for builder in builders]
+        levels = tree_levels([topology.parent for topology in topologies], [topology.index[builder.root_id] for topology, builder in zip(topologies, builders)])
+        for builder, builder_levels in zip(builders, levels):
+            builder.assign_depth_levels(builder_levels)
+
+        return [builder.complete_tree() for builder in builders]
+
+    def init_tree(self):
+        if self.base_topology is None:
+            self.base_topology = TreeTopology.from_tree(self.nodes, self.edges)
+        self.topology = self.base_topology.copy()
+        # tree dependent node values, aligned with `self.nodes`
+        self.levels = np.zeros(len(self.nodes), dtype=np.int64)
+        self.first_edu = np.full(len(self.nodes), -1, dtype=np.int64)
+        self.last_edu = np.full(len(self.nodes), -1, dtype=np.int64)
+        self.explicit_edus: dict[int, list[int]] = {}
+
+    def complete_tree(self):
         self.attach_child_nodes()
         self.populate_edus()  
 
@@ -45,99 +122,161 @@ class TreeBuilder():
         edges_df = self.edges_to_dataframe() 
         return nodes_df, edges_df
 
+    def edu_parents(self) -> np.ndarray:
+        """Integer ids of the nodes that get an EDU leaf attached, by default the nodes without children."""
+        return self.topology.leaves()
+
     def attach_child_nodes(self):
-        edges_c2p = self.edges_as_c2p_dict()
-        child_nodes = edges_c2p.keys()
-        parent_nodes = edges_c2p.values()
-        leaf_nodes = child_nodes - parent_nodes  # Nodes without children
+        topology = self.topology
+        leaf_indices = self.edu_parents()
+        leaf_positions = topology.node_position[leaf_indices]
 
-        for leaf_id in leaf_nodes:
-            leaf_node = next(node for node in self.nodes if node.id == leaf_id)
+        shared = self.edu_layer is not None
+        edu_nodes = []
+        for leaf_position in leaf_positions.tolist():
+            leaf_node = self.nodes[leaf_position]
             
             edu_index = leaf_node.edu_index  # Since leaves only have one EDU
+            if shared:
+                edu_node = self.edu_layer.node(edu_index, self.segments[edu_index])
+                edu_nodes.append(edu_node)
+                self.edges.append(Edge(child=edu_node.id, parent=leaf_node.id))
+                continue
+
             edu_text = f"{edu_index + 1}. {self.segments[edu_index]}"
 
             wrapped_text = wrap_text(edu_text)
 
             edu_node = RelationNode(
-                id=f'{leaf_id}_edu',
+                id=f'{leaf_node.id}_edu',
                 edu_index=edu_index,
-                level=leaf_node.level + 1,
                 annotator=leaf_node.annotator,
                 is_leaf=True,
-                label=wrapped_text
+                label=wrapped_text,
+                text=self.segments[edu_index]
             )
-            self.nodes.append(edu_node)
+            edu_nodes.append(edu_node)
             
             edu_edge = Edge(
                 child=edu_node.id,
-                parent=leaf_id
+                parent=leaf_node.id
             )
             self.edges.append(edu_edge)
 
+        topology.add_nodes(
+            [edu_node.id for edu_node in edu_nodes],
+            parents=leaf_indices,
+            edge_index=np.arange(len(self.edges) - len(edu_nodes), len(self.edges)),
+            node_position=np.arange(len(self.nodes), len(self.nodes) + len(edu_nodes))
+        )
+        self.nodes.extend(edu_nodes)
+        self.levels = np.concatenate([self.levels, self.levels[leaf_positions] + 1])
+
     def populate_edus(self):
-        node_lookup = {node.id: node for node in self.nodes}
+        """Computes the EDU interval of every node bottom-up, one vectorized step per tree level.
 
-        for node in self.nodes:
-            if node.is_leaf:
-                node.edus = [node.edu_index]
-            else:
-                node.edus = []
+        Every childless leaf contributes its EDU, each level then folds the first/last EDU and the EDU count of its
+        nodes into their parents. A span whose count does not match its width is not contiguous; such nodes also
+        get their explicit 'edus' list if `discontinuous_edus` is set.
+        """
+        topology = self.topology
+        entries = topology.node_entries()
 
-        parent_to_children = self.edges_as_p2c_dict()
+        is_leaf = np.zeros(len(topology), dtype=bool)
+        is_leaf[entries] = np.fromiter(map(attrgetter('is_leaf'), self.nodes), dtype=bool, count=len(self.nodes))
+        edu_index = np.zeros(len(topology), dtype=np.int64)
+        edu_index[entries] = np.fromiter(map(attrgetter('edu_index'), self.nodes), dtype=np.int64, count=len(self.nodes))
 
-        processed_nodes = set()
-        for node in self.nodes:
-            node.edus = self._collect_edus(node.id, node_lookup, parent_to_children, processed_nodes)
+        contributes = is_leaf & (topology.child_counts() == 0)
+        first = np.where(contributes, edu_index, np.iinfo(np.int64).max)
+        last = np.where(contributes, edu_index, -1)
+        count = contributes.astype(np.int64)
+
+        # children are folded into their parents deepest level first
+        for frontier in reversed(topology.bfs_frontiers(topology.index[self.root_id])[1:]):
+            parents = topology.parent[frontier]
+            np.minimum.at(first, parents, first[frontier])
+            np.maximum.at(last, parents, last[frontier])
+            np.add.at(count, parents, count[frontier])
+
+        first[count == 0] = -1
+        self.first_edu = first[entries]
+        self.last_edu = last[entries]
+
+        self.explicit_edus = {}
+        if self.discontinuous_edus:
+            count = count[entries]
+            discontinuous = np.flatnonzero((count > 0) & (count != self.last_edu - self.first_edu + 1))
+            for position, entry in zip(discontinuous.tolist(), entries[discontinuous].tolist()):
+                descendants = topology.descendants(entry)
+                self.explicit_edus[position] = sorted(edu_index[descendants[contributes[descendants]]].tolist())
+
+    def assign_depth_levels(self, levels: np.ndarray | None =None):
+        """Assigns the tree depth level of each node below the root.
+
+        `levels` holds the depths of all topology entries if they were computed already, see `build_many`.
+        """
+        topology = self.topology
+        if levels is None:
+            levels = topology.depth_levels(topology.index[self.root_id])
+        levels = levels[topology.node_entries()]
+
+        unreachable = np.flatnonzero(levels < 0)
+        if unreachable.size:
+            raise KeyError(self.nodes[unreachable[0]].id)
+        self.levels = levels
 
-    @abstractmethod
-    def assign_depth_levels(self):
-        """Performs Breadth First Search to assign tree depth level to each node."""
-        pass
-    
     @abstractmethod
     def redirect_edges(self, satellites: list[str] =[]) -> None:
         """Replaces the parent by the grandparent for each satellite node according to the structure of a constituent tree."""
         pass
 
-    def _collect_edus(self, node_id, node_lookup, parent_to_children, processed):
-        """Recursively collect EDUs for a given node."""
-        if node_id in processed:
-            return node_lookup[node_id].edus  # Avoid redundant computation
-        
-        collected_edus = list(node_lookup[node_id].edus)
-
-        if node_id in parent_to_children:  # If the node has children
-            for child_id in parent_to_children[node_id]:
-                child_edus = self._collect_edus(child_id, node_lookup, parent_to_children, processed)  # Get child's 'edus'
-                collected_edus.extend(child_edus)
-
-            collected_edus.sort()
-        
-        node_lookup[node_id].edus = collected_edus
-        processed.add(node_id)
-        return collected_edus
-    
-    def edges_as_p2c_dict(self) -> dict:
-        """Converts a list of edges to a dictionary map from parent to children IDs as values."""
-        p2c_map = {}
-        for edge in self.edges:
-            p2c_map.setdefault(edge.parent, []).append(edge.child)
-        return p2c_map
-
-    def edges_as_c2p_dict(self) -> dict:
-        """Converts a list of edges to a dictionary with child IDs as keys and parent IDs as values."""
-        p2c_map = {}
-        for edge in self.edges:
-            p2c_map[edge.child] = edge.parent
-        return p2c_map
+    def redirect_satellites_to_grandparents(self) -> None:
+        """Moves every satellite node below its grandparent.
+
+        All grandparents are looked up before any node is moved, so moved nodes never move twice.
+        """
+        topology = self.topology
+        satellites = topology.indices(self.satellite_node_ids)
+        satellites = satellites[topology.parent[satellites] >= 0]
+        grandparents = topology.parent[topology.parent[satellites]]
+
+        moved = grandparents >= 0
+        satellites, grandparents = satellites[moved], grandparents[moved]
+        topology.set_parents(satellites, grandparents)
 
     def edges_to_dataframe(self) -> pd.DataFrame:
-        """Converts a list of edges to a DataFrame with columns 'from' and 'to'."""
-        data = [{"from": edge.child, "to": edge.parent} for edge in self.edges]
-        return pd.DataFrame(data)
+        """Converts the edges of the built tree to a DataFrame with columns 'from' and 'to', in edge list order."""
+        topology = self.topology
+        children = np.flatnonzero(topology.edge_index >= 0)
+        children = children[np.argsort(topology.edge_index[children], kind='stable')]
+        ids = np.array(topology.ids, dtype=object)
+        return pd.DataFrame({
+            "from": ids[children].tolist(),
+            "to": ids[topology.parent[children]].tolist(),
+        })
     
     def nodes_to_dataframe(self):
-        """Converts a list of nodes to a DataFrame with columns named after node fields."""
-        return pd.DataFrame([node.__dict__ for node in self.nodes])
+        """Converts the nodes and their levels and EDU spans to a DataFrame, built column by column."""
+        def column(name):
+            return list(map(attrgetter(name), self.nodes))
+
+        edus = [None] * len(self.nodes)
+        for position, explicit_edus in self.explicit_edus.items():
+            edus[position] = explicit_edus
+
+        return pd.DataFrame({
+            'id': column('id'),
+            'relation': pd.Categorical(column('relation')),
+            'nuclearity': pd.Categorical(column('nuclearity')),
+            'level': self.levels,
+            'annotator': pd.Categorical(column('annotator')),
+            'first_edu': self.first_edu,
+            'last_edu': self.last_edu,
+            'edus': edus,
+            'edu_index': np.fromiter(column('edu_index'), dtype=np.int64, count=len(self.nodes)),
+            'is_leaf': np.fromiter(column('is_leaf'), dtype=bool, count=len(self.nodes)),
+            'label': column('label'),
+            'text': column('text'),
+        })
 
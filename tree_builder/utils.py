@@ -1,3 +1,8 @@
+from functools import lru_cache
+
+
+# the same EDUs are wrapped for every annotator, memoizing also shares the resulting strings
+@lru_cache(maxsize=65536)
 def wrap_text(text, max_length=15):
     """
     Wraps the input text to a given max line length without breaking words.